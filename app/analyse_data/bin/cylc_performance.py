@@ -1,9 +1,16 @@
 """Code for analysing and plotting data from cylc job logs stored in a CSV file.""" 
 
+import hashlib
+import os
+import time
 import numpy as np
 import pandas as pd 
 from pandas.tseries.offsets import DateOffset
 import matplotlib.pyplot as plt
+import job_schema
+import job_store
+import task_metrics
+from render_plots import PlotSpec
 
 def setup_plots(): 
     """Set plotting parameters"""
@@ -12,6 +19,27 @@ def setup_plots():
     plt.rcParams['figure.figsize'] = (12,6)
 
 
+def plot_suite(job_data, method, **kwargs): 
+    """Call plotting method of job data for a single suite."""
+    getattr(job_data, method)(**kwargs)
+
+
+def write_suite_index(suite_dir, suite_status): 
+    """Write HTML page linking to all per-suite plots in suite_dir."""
+    plots = sorted(f for f in os.listdir(suite_dir) if f.endswith('.png'))
+    lines = ['<html><head><title>CANARI suite plots</title></head><body>', 
+             '<h1>CANARI suite plots</h1>']
+    for suite in suite_status.suites: 
+        suite_plots = [f for f in plots if f.startswith(suite+'_')]
+        if not suite_plots: 
+            continue
+        lines.append('<h2 id="{0}">{0}: {1}</h2>'.format(suite, suite_status.data.loc[suite, 'Description']))
+        lines += ['<a href="{0}"><img src="{0}" width="400"></a>'.format(f) for f in suite_plots]
+    lines.append('</body></html>')
+    with open(os.path.join(suite_dir, 'index.html'), 'w') as f: 
+        f.write('\n'.join(lines) + '\n')
+
+
 class SuiteStatus: 
     """Suite status data"""
 
@@ -19,21 +47,144 @@ class SuiteStatus:
         dt_cols = ['First cycle', 'Start time'] 
         index_col = 'Suite id'        
 
-        self.data = pd.read_csv(csv_file, index_col=index_col, parse_dates=dt_cols) 
+        if csv_file.endswith('.parquet'): 
+            self.data = job_store.read_table(csv_file)
+        else: 
+            self.data = pd.read_csv(csv_file, index_col=index_col, parse_dates=dt_cols) 
         self.suites = self.data.index
+        self.file = csv_file
+
+
+class DerivedCache: 
+    """On-disk cache of derived job data. 
+
+    Entries are keyed by a hash of the content of the input files, this 
+    module and the job data schema, so change when the data or the 
+    derivation code changes. Entries 
+    not used for max_age days are removed when a new entry is saved."""
+
+    def __init__(self, cache_dir, max_age=3): 
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, name, input_paths, extra=None): 
+        """Cache key for a dataset derived from files or directories, 
+        and optionally a list of other values, e.g. columns read."""
+        digest = hashlib.sha1(name.encode())
+        if extra is not None: 
+            digest.update(repr(list(extra)).encode())
+        for path in [__file__, job_schema.__file__] + list(input_paths): 
+            if os.path.isdir(path): 
+                files = sorted(os.path.join(root, f) for root, _, names in os.walk(path) for f in names)
+            else: 
+                files = [path]
+            for file in files: 
+                digest.update(file.encode())
+                with open(file, 'rb') as f: 
+                    for chunk in iter(lambda: f.read(1 << 20), b''): 
+                        digest.update(chunk)
+        return '{}-{}'.format(name, digest.hexdigest())
+
+    def path(self, key): 
+        """File for a cache entry."""
+        return os.path.join(self.cache_dir, key+'.pkl')
+
+    def load(self, key): 
+        """Load cached data, or None if not cached."""
+        path = self.path(key)
+        if not os.path.isfile(path): 
+            return None
+        os.utime(path)
+        return pd.read_pickle(path)
+
+    def save(self, key, data): 
+        """Save data to cache and evict old entries."""
+        tmp_path = self.path(key) + '.tmp'
+        data.to_pickle(tmp_path)
+        os.replace(tmp_path, self.path(key))
+        self.evict()
+
+    def evict(self): 
+        """Remove entries not used for max_age days."""
+        cutoff = time.time() - self.max_age*86400
+        for entry in os.scandir(self.cache_dir): 
+            if entry.name.endswith('.pkl') and entry.stat().st_mtime < cutoff: 
+                os.remove(entry.path)
 
 
 class CylcJobData:
     """Data from cylc job logs for a particular task."""
 
-    def __init__(self, csv_file, task_name, suite_status): 
-        index_col = 'Batch id'
-        dt_cols = ['Cycle', 'Submit time', 'Init time', 'Exit time'] 
-        types = {'Batch id' : str} 
-
-        self.data = pd.read_csv(csv_file, index_col=index_col, dtype=types, parse_dates=dt_cols)
+    def __init__(self, csv_file, task_name, suite_status, store_dir=None, suites=None, columns=None, data=None): 
+        """Load from columnar store if it has data for this task, otherwise 
+        from CSV file. Only the store can limit the suites and columns read. 
+        If data is given, use that instead. Data read is checked against 
+        the job data schema."""
+        if data is not None: 
+            self.data = data
+        elif job_store.has_task(store_dir, task_name): 
+            self.data = job_store.read_task(store_dir, task_name, suites=suites, columns=columns)
+        else: 
+            self.data = job_schema.read_csv(csv_file, required=job_schema.JOB_COLS+['Suite id'])
         self.task_name = task_name
         self.suite_status = suite_status
+        self.rollups = None
+
+    @classmethod
+    def load_derived(cls, csv_file, suite_status, store_dir=None, columns=None, cache=None): 
+        """Load data and derive columns. If a cache is given, load derived data 
+        from it if inputs are unchanged, otherwise save derived data to it."""
+        if cache is not None: 
+            source = csv_file
+            if job_store.has_task(store_dir, cls.TASK): 
+                source = job_store.task_dir(store_dir, cls.TASK)
+            name = cls.TASK if columns is None else '{}-{}'.format(cls.TASK, len(columns))
+            key = cache.key(name, [suite_status.file, source], extra=columns)
+            data = cache.load(key)
+            if data is not None: 
+                return cls(csv_file, suite_status, data=data)
+
+        job_data = cls(csv_file, suite_status, store_dir, columns=columns)
+        job_data.derive()
+        if cache is not None: 
+            cache.save(key, job_data.data)
+        return job_data
+
+    def derive(self): 
+        """Derive columns used for analysis."""
+        pass
+
+    # Columns added or changed by derive()
+    DERIVED_COLS = []
+
+    # Metrics kept in daily rollups, metric: column giving the day of each job
+    ROLLUP_METRICS = {}
+
+    # Per-suite plots, name: (plotting method, column plotted, title, kwargs)
+    SUITE_PLOTS = {}
+
+    def has_rollups(self): 
+        """Whether daily rollups have been loaded for this task."""
+        return self.rollups is not None and self.rollups.has_task(self.task_name)
+
+    def suite_plot_specs(self, suite_dir): 
+        """Plot specs for per-suite plots. Data is grouped by suite once, and 
+        each plot is given just the data for its suite."""
+        os.makedirs(suite_dir, exist_ok=True)
+        suite_rollups = self.rollups.by_suite() if self.rollups is not None else {}
+        specs = []
+        for suite, data in self.data.groupby('Suite id', observed=True, sort=True): 
+            suite_data = type(self)(None, self.suite_status, data=data)
+            suite_data.rollups = suite_rollups.get(suite)
+            for name, (method, col, title, kwargs) in self.SUITE_PLOTS.items(): 
+                if data[col].notna().sum() == 0: 
+                    continue
+                plot_file = '{}/{}_{}_{}.png'.format(suite_dir, suite, self.task_name, name)
+                specs.append(PlotSpec(plot_suite, dict(
+                    job_data=suite_data, method=method, plot_file=plot_file, 
+                    title=title.format(suite), **kwargs)))
+        return specs
 
     def write(self, out_file, cols=None): 
         """Write data as CSV file."""
@@ -42,21 +193,31 @@ class CylcJobData:
         else:
             self.data.to_csv(out_file)
 
+    def write_store(self, store_dir, task_name=None): 
+        """Write data to columnar store, by default under this task."""
+        job_store.write_task(self.data, store_dir, task_name or self.task_name)
+
     def plot_status(self, plot_file, title, suites=None, mean=False, hlines=None, y_ticks=None):
-        """Plot number of task successes and failures per day."""
-        # Filter data by suites 
-        if suites is not None: 
-            data = self.data[self.data['Suite id'].isin(suites)]
-        else:
-            data = self.data 
+        """Plot number of task successes and failures per day. 
+        Counts are read from daily rollups if loaded."""
+        if self.has_rollups(): 
+            status_by_date = self.rollups.status_by_date(self.task_name, suites)
+        else: 
+            # Filter data by suites 
+            if suites is not None: 
+                data = self.data[self.data['Suite id'].isin(suites)]
+            else:
+                data = self.data 
         
-        # Group by exit status 
-        status_by_date = data.groupby(data['Init time'].dt.date)['Exit status'].value_counts()
+            # Group by exit status 
+            status_by_date = data.groupby(data['Init time'].dt.date)['Exit status'].value_counts()
 
-        # Reindex and fill with 0 for dates with no data
+        # Reindex and fill with 0 for dates with no data, 
+        # and for statuses plotted that don't occur (e.g. for a single suite)
         dates = pd.date_range(status_by_date.index.get_level_values(0)[0], 
                           status_by_date.index.get_level_values(0)[-1])
-        new_index = pd.MultiIndex.from_product([dates, status_by_date.index.levels[1]], 
+        statuses = status_by_date.index.levels[1].union(['SUCCEEDED', 'EXIT'])
+        new_index = pd.MultiIndex.from_product([dates, statuses], 
                                                names = ["Init time", "Exit status"])
         status_by_date = status_by_date.reindex(new_index, fill_value=0)
 
@@ -84,12 +245,15 @@ class CylcJobData:
             ax.set_yticks(y_ticks)
         ax.set_title(title)
 
-        plt.savefig(plot_file)   
+        plt.savefig(plot_file)
+        plt.close(fig)
 
     def plot_quantity(self, plot_file, title, x_col, y_col, x_label, y_label, 
                       data_label='', y_ticks=None, 
-		      job_filter=None, mean=False, hlines=None, status=False):
-        """Plot some metric against time. Note: can't plot status and mean together."""        
+		      job_filter=None, mean=False, hlines=None, status=False, rollup_filter=None):
+        """Plot some metric against time. Note: can't plot status and mean together. 
+        Daily means are read from daily rollups if loaded, for the jobs given by 
+        rollup_filter (suites and statuses)."""        
         # Filter 
         if job_filter is not None: 
             data = self.data[job_filter]
@@ -117,7 +281,10 @@ class CylcJobData:
  
         # Daily means 
         if mean and not status: 
-            mean_sypd_by_date = data.groupby(data[x_col].dt.date)[y_col].mean()
+            if self.has_rollups() and self.ROLLUP_METRICS.get(y_col) == x_col: 
+                mean_sypd_by_date = self.rollups.daily_mean(self.task_name, y_col, **(rollup_filter or {}))
+            else: 
+                mean_sypd_by_date = data.groupby(data[x_col].dt.date)[y_col].mean()
             dates = pd.date_range(mean_sypd_by_date.index[0], mean_sypd_by_date.index[-1])
             mean_sypd_by_date = mean_sypd_by_date.reindex(dates, fill_value=pd.NA) 
             mean_sypd_by_date.index = mean_sypd_by_date.index.tz_localize('UTC')
@@ -138,47 +305,113 @@ class CylcJobData:
         plt.title(title, y=1.15)
 
         plt.savefig(plot_file)
+        plt.close(fig)
+
+    def plot_percentiles(self, plot_file, title, y_col, y_label, quantiles=(0.5, 0.9), 
+                         suites=None, statuses=None, hlines=None): 
+        """Plot percentiles of a metric each day, by the day the metric is rolled up 
+        on. Read from the sketches in daily rollups if loaded, otherwise from the jobs."""
+        x_col = self.ROLLUP_METRICS[y_col]
+        if not self.has_rollups(): 
+            data = self.data
+            if suites is not None: 
+                data = data[data['Suite id'].isin(suites)]
+            if statuses is not None: 
+                data = data[data['Exit status'].isin(statuses)]
+
+        fig, ax = plt.subplots()
+
+        # Plot horizontal lines underneath
+        if hlines is not None: 
+            for yval in hlines: 
+                plt.axhline(y=yval, color='black', linewidth=0.5, label='_')
+
+        for q, color in zip(quantiles, ['navy', 'deepskyblue', 'red', 'orange']): 
+            if self.has_rollups(): 
+                by_date = self.rollups.daily_quantile(self.task_name, y_col, q, suites, statuses)
+            else: 
+                # Lower value at rank q, as the sketches give
+                by_date = data.groupby(data[x_col].dt.date)[y_col].quantile(q, interpolation='lower')
+            by_date.index = pd.to_datetime(by_date.index).tz_localize('UTC') + DateOffset(hours=12)
+            by_date.plot(ax=ax, color=color, label='{:g}th percentile'.format(q*100))
+
+        plt.legend(loc='upper left')
+        ax.set_xlabel(x_col)
+        ax.set_ylabel(y_label)
+        ax.set_title(title)
+
+        plt.savefig(plot_file)
+        plt.close(fig)
 			      
     
 class CoupledData(CylcJobData):
     """Cylc job log data from coupled task."""
 
-    def __init__(self, csv_file, suite_status):
-        CylcJobData.__init__(self, csv_file, 'coupled', suite_status) 
+    TASK = 'coupled'
+
+    SUITE_PLOTS = {
+        'runtime': ('plot_runtime', 'Elapsed time (h)', '{} coupled task run times', dict(status=True)), 
+        'queue_time': ('plot_queue_time', 'Queued time (h)', '{} coupled task queue times', dict(mean=True)), 
+        'sypd': ('plot_sypd', 'SYPD', '{} SYPD for successful coupled tasks', dict(mean=True))}
+
+    DERIVED_COLS = ['File system', 'XIOS logs', 'Exit status', 
+                    'Queued time (h)', 'Elapsed time (h)', 'SYPD']
+
+    ROLLUP_METRICS = {
+        'Elapsed time (s)': 'Init time', 
+        'Elapsed time (h)': 'Init time', 
+        'Queued time (h)': 'Submit time', 
+        'SYPD': 'Init time'}
+
+    def __init__(self, csv_file, suite_status, store_dir=None, suites=None, columns=None, data=None):
+        CylcJobData.__init__(self, csv_file, self.TASK, suite_status, store_dir, suites, columns, data) 
+
+    def derive(self): 
+        """Derive file system, XIOS logs, corrected exit status and metrics."""
+        self.set_filesystem() 
+        self.set_xios_logs()
+        self.reset_errors()
+        self.calc_metrics()
+
+    def suite_values(self, col): 
+        """Values of a suite status column for each job, joined on suite id."""
+        values = self.suite_status.data[col].reindex(self.data['Suite id'])
+        values.index = self.data.index
+        return values
+
+    def suite_cycles(self, col): 
+        """Cycle given in a suite status column for each job, as cycle point."""
+        return job_schema.as_cycles(self.suite_values(col))
 
     def set_filesystem(self):
         """Work out whether jobs ran on spinning disk or nVME."""
-        self.data['File system'] = 'Disk' 
-        nvme_suites = self.suite_status.data[self.suite_status.data['File system'] == 'NVMe'].index    
-        for nvme_suite in nvme_suites: 
-            first_cycle = self.suite_status.data.loc[nvme_suite, 'First NVMe cycle']
-            cycles = (self.data['Suite id'] == nvme_suite) & (self.data['Cycle'] >= first_cycle)
-            self.data.loc[cycles, 'File system'] = 'NVMe'
+        nvme = ( (self.suite_values('File system') == 'NVMe') & 
+                 (self.data['Cycle'] >= self.suite_cycles('First NVMe cycle')) )
+        self.data['File system'] = job_schema.as_category(
+            pd.Series(np.where(nvme, 'NVMe', 'Disk'), index=self.data.index), 
+            job_schema.CATEGORIES['File system'])
 
     def set_xios_logs(self): 
         """Work out whether job ran with XIOS logging on or off."""
-        self.data['XIOS logs'] = True
-        logs_off_suites = self.suite_status.data[~self.suite_status.data['XIOS logs']].index 
-        for suite in logs_off_suites:     
-            first_cycle = self.suite_status.data.loc[suite, 'First no log cycle']
-            cycles = (self.data['Suite id'] == suite) & (self.data['Cycle'] >= first_cycle)
-            self.data.loc[cycles, 'XIOS logs'] = False
+        logs_off = ( (self.suite_values('XIOS logs') == False) & 
+                     (self.data['Cycle'] >= self.suite_cycles('First no log cycle')) )
+        self.data['XIOS logs'] = ~logs_off
 
     def reset_errors(self): 
         """Fix cycles which are marked as succeeded but actually failed."""
         suites_3m = self.suite_status.data[self.suite_status.data['Cycle length (days)'] == 90].index
         jobs = (self.data['Suite id'].isin(suites_3m)) & (self.data['Elapsed time (s)'] < 7200)
-        self.data.loc[jobs, 'Exit status'] = 'EXIT'
+        self.data['Exit status'] = self.data['Exit status'].mask(jobs, 'EXIT')
 
     def calc_metrics(self): 
         """Calculate run/queue time in h and SYPD."""
         self.data['Queued time (h)'] = self.data['Queued time (s)'] / 3600.0
         self.data['Elapsed time (h)'] = self.data['Elapsed time (s)'] / 3600.0
 
-        for suite in self.suite_status.suites: 
-            cycles_per_year = 360 / self.suite_status.data.loc[suite, 'Cycle length (days)'] 
-            successful_jobs = (self.data['Suite id'] == suite) & (self.data['Exit status'] == 'SUCCEEDED')
-            self.data.loc[successful_jobs, 'SYPD'] = 86400.0 / (self.data.loc[successful_jobs, 'Elapsed time (s)']*cycles_per_year)
+        cycles_per_year = 360 / self.suite_values('Cycle length (days)')
+        successful_jobs = self.data['Exit status'] == 'SUCCEEDED'
+        sypd = 86400.0 / (self.data['Elapsed time (s)']*cycles_per_year)
+        self.data['SYPD'] = sypd.where(successful_jobs)
 
     def plot_runtime_filesystem(self, plot_file, title, suites=None, date_string='2023-03-01', ms=2, xios_logs=False): 
         """Plot time to completion for successful tasks. 
@@ -242,6 +475,7 @@ class CoupledData(CylcJobData):
         plt.title(title, y=1.25) 
 
         plt.savefig(plot_file)
+        plt.close(fig)
 
     def plot_queue_time(self, plot_file, title, suites=None, mean=False, hlines=None):
         """Plot queue time for all jobs."""
@@ -254,7 +488,8 @@ class CoupledData(CylcJobData):
                            x_col='Submit time', y_col='Queued time (h)', 
 			   x_label='Submission time', y_label='Queue time (h)', 
 	                   data_label='Queue time per job', 
-		           job_filter=job_filter, mean=mean, hlines=hlines)
+		           job_filter=job_filter, mean=mean, hlines=hlines, 
+                           rollup_filter=dict(suites=suites))
 
     def plot_sypd(self, plot_file, title, suites=None, mean=False, hlines=None, y_ticks=None):
         """Plot SYPD for successful tasks."""
@@ -266,7 +501,8 @@ class CoupledData(CylcJobData):
         self.plot_quantity(plot_file=plot_file, title=title, 
 	                   x_col='Init time', y_col='SYPD', x_label='Start time', y_label='SYPD', 
 	                   data_label='SYPD per job', y_ticks=y_ticks, 
-			   job_filter=job_filter, mean=mean, hlines=hlines)
+			   job_filter=job_filter, mean=mean, hlines=hlines, 
+                           rollup_filter=dict(suites=suites))
 			   
     def plot_runtime(self, plot_file, title, suites=None, mean=False, hlines=None, y_ticks=None, status=False):
         """Plot run time. If status specified plot succeeded and failed jobs, otherwise just succeede ones."""
@@ -281,14 +517,31 @@ class CoupledData(CylcJobData):
 	                   x_col='Init time', y_col='Elapsed time (h)', 
 			   x_label='Start time', y_label='Time to completion (h)', 
 	                   data_label='Run time per job', y_ticks=y_ticks, 
-			   job_filter=job_filter, mean=mean, hlines=hlines, status=status)
+			   job_filter=job_filter, mean=mean, hlines=hlines, status=status, 
+                           rollup_filter=dict(suites=suites, statuses=None if status else ['SUCCEEDED']))
 		
 
 class PPTransferData(CylcJobData): 
     """Cylc job log data from pptransfer task."""
 
-    def __init__(self, csv_file, suite_status):
-        CylcJobData.__init__(self, csv_file, 'pptransfer', suite_status)
+    TASK = 'pptransfer'
+
+    SUITE_PLOTS = {
+        'status': ('plot_status', 'Exit status', '{} transfer task statuses each day', {}), 
+        'speed': ('plot_speed', 'Speed (MB/s)', '{} speed of successful transfer tasks', dict(mean=True))}
+
+    DERIVED_COLS = ['Speed (MB/s)']
+
+    ROLLUP_METRICS = {
+        'Elapsed time (s)': 'Init time', 
+        'Speed (MB/s)': 'Init time'}
+
+    def __init__(self, csv_file, suite_status, store_dir=None, suites=None, columns=None, data=None):
+        CylcJobData.__init__(self, csv_file, self.TASK, suite_status, store_dir, suites, columns, data)
+
+    def derive(self): 
+        """Derive transfer speed."""
+        self.calc_metrics()
 	
     def calc_metrics(self): 
         """Work out transfer speed. Ignore some outliers."""
@@ -317,4 +570,44 @@ class PPTransferData(CylcJobData):
                            x_col='Init time', y_col='Speed (MB/s)', 
                            x_label='Start time', y_label='Transfer speed (MB/s)', 
                            data_label='Speed of transfer job (MB/s)', 
+                           job_filter=job_filter, mean=mean, hlines=hlines, 
+                           rollup_filter=dict(suites=suites))
+
+
+class PipelineMetrics(CylcJobData): 
+    """Metrics of the stages of this workflow's own tasks, from the pipeline 
+    metrics file written by task_metrics."""
+
+    TASK = 'pipeline'
+
+    COLUMNS = {'time': 'Time', 'task': 'Task', 'cycle': 'Cycle', 'stage': 'Stage', 
+               'suite': 'Suite id', 'wall': 'Wall time (s)', 'cpu': 'CPU time (s)', 
+               'max_rss_kb': 'Max RSS (kB)', 'ok': 'OK', 
+               'files': 'Files', 'bytes': 'Bytes', 'rows': 'Rows'}
+
+    def __init__(self, metrics_file, data=None): 
+        if data is None: 
+            data = pd.DataFrame(task_metrics.read_records(metrics_file), columns=list(self.COLUMNS))
+            data = data.rename(columns=self.COLUMNS)
+            data['Time'] = pd.to_datetime(data['Time'], utc=True)
+        CylcJobData.__init__(self, None, self.TASK, None, data=data)
+
+    def derive(self): 
+        """Derive times in minutes and peak memory in GB."""
+        self.data['Wall time (min)'] = self.data['Wall time (s)'] / 60
+        self.data['CPU time (min)'] = self.data['CPU time (s)'] / 60
+        self.data['Max RSS (GB)'] = self.data['Max RSS (kB)'] / 1024**2
+
+    def tasks(self, stage='task'): 
+        """Tasks with metrics for a stage."""
+        return sorted(self.data.loc[self.data['Stage'] == stage, 'Task'].unique())
+
+    def plot_runtime(self, plot_file, title, task, stage='task', y_col='Wall time (min)', 
+                     mean=False, hlines=None): 
+        """Plot run time of a task stage, by default the whole task."""
+        job_filter = (self.data['Task'] == task) & (self.data['Stage'] == stage)
+        self.plot_quantity(plot_file=plot_file, title=title, 
+                           x_col='Time', y_col=y_col, 
+                           x_label='End time', y_label=y_col, 
+                           data_label='{} of {}'.format(y_col.split(' (')[0], stage), 
                            job_filter=job_filter, mean=mean, hlines=hlines)
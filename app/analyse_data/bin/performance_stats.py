@@ -4,41 +4,61 @@ import os
 import pandas as pd
 from datetime import datetime
 from cylc_performance import *
+from suite_stats import SuiteStats, state_lock
+import job_schema
+import task_metrics
 
 # To Do: Reorganise this code. Calcs could go in CoupledData class
 
-def generate_stats(data_dir='.', perf_file='./suite_perf.csv'):
+def generate_stats(data_dir='.', perf_file='./suite_perf.csv', state_file=None, window=None):
     """Generate performance data for suites: 
     - Run progress
     - SYPD 
     - ASYPD
+    Running aggregates of successful jobs for each suite are kept in state_file 
+    (by default DATA_DIR/stats/coupled_state.json), and only new jobs in the 
+    processed files are read. The state file is locked while it's updated.
+    With a window (days), also SYPD over the last window days each suite ran.
     """
     # Load data 
     suite_status = SuiteStatus(data_dir+'/suite_status.csv')     
-    coupled = CoupledData(data_dir+'/coupled_jobs.csv', suite_status)
-    coupled.reset_errors() 
-    
-    # Drop un-completed entries
-    coupled.data.drop(coupled.data[coupled.data['Exit status']!='SUCCEEDED'].index, inplace=True)
+    state_file = state_file or data_dir+'/stats/coupled_state.json'
+
+    def reset_errors(jobs): 
+        coupled = CoupledData(None, suite_status, data=jobs)
+        coupled.reset_errors()
+        return coupled.data
+
+    with task_metrics.Stage('stats') as stage, state_lock(state_file):
+        stats = SuiteStats(state_file, CoupledData.TASK)
+        updated = stats.update(data_dir+'/processed', suite_status, derive=reset_errors)
+        stats.save()
+        stage.add(files=len(updated))
+    print("Updated stats for {} suites".format(len(updated)))
+    aggregates = stats.aggregates(window)
     
     # SYPD
-    data_by_suite = coupled.data.groupby('Suite id')
-    suite_status.data['Mean elapsed time (s)'] = data_by_suite['Elapsed time (s)'].mean()
+    suite_status.data['Mean elapsed time (s)'] = aggregates['Mean elapsed time (s)']
     suite_status.data['SYPD'] = 86400 / (suite_status.data['Mean elapsed time (s)'] * 360 
                                          / suite_status.data['Cycle length (days)'])
+    if window: 
+        window_col = 'SYPD (last {} days)'.format(window)
+        suite_status.data[window_col] = 86400 / (aggregates['Window mean elapsed time (s)'] * 360 
+                                                 / suite_status.data['Cycle length (days)'])
 
     # Run progress 
     suite_status.data['Target run length (years)'] = (suite_status.data['Cycle length (days)'] * 
                                                       suite_status.data['Run length (cycles)']) / 360
 
-    # Maybe need to use cftime to work out 360 day calendar ? 
-    suite_status.data['Last completed cycle'] = data_by_suite.last()['Cycle']
-    years = suite_status.data['Last completed cycle'].dt.year - suite_status.data['First cycle'].dt.year
-    months = suite_status.data['Last completed cycle'].dt.month-1 + suite_status.data['Cycle length (days)']/30
+    # Year and month from the cycle point, which may be a 360 day date
+    suite_status.data['Last completed cycle'] = aggregates['Last completed cycle']
+    last_year, last_month = job_schema.cycle_year_month(suite_status.data['Last completed cycle'])
+    years = last_year - suite_status.data['First cycle'].dt.year
+    months = last_month-1 + suite_status.data['Cycle length (days)']/30
     suite_status.data['Run progress (years)'] = years + months/12
     
     # ASYPD 
-    suite_status.data['End time'] = data_by_suite.last()['Exit time']
+    suite_status.data['End time'] = aggregates['End time']
     suite_status.data['Run time (days)'] = (suite_status.data['End time'] - suite_status.data['Start time']).dt.total_seconds() / 86400
     suite_status.data['ASYPD'] = suite_status.data['Run progress (years)'] / suite_status.data['Run time (days)']
 
@@ -47,10 +67,14 @@ def generate_stats(data_dir='.', perf_file='./suite_perf.csv'):
                   'Target run length (years)', 'Run progress (years)',
                   'SYPD','ASYPD']
     round_cols = ['SYPD','ASYPD']
+    if window: 
+        write_cols.append(window_col)
+        round_cols.append(window_col)
     suite_status.data[round_cols] = suite_status.data[round_cols].round(decimals=2)
     suite_status.data.to_csv(perf_file, columns=write_cols)
     
 if __name__=='__main__':
     data_dir = os.environ.get('DATA_DIR', '/gws/nopw/j04/canari/users/aosprey/log-analysis/data')
     stats_dir = os.environ.get('STATS_DIR', '.') 
-    generate_stats(data_dir, stats_dir+'/suite_perf.csv')
+    window = int(os.environ.get('STATS_WINDOW') or 0) or None
+    generate_stats(data_dir, stats_dir+'/suite_perf.csv', window=window)
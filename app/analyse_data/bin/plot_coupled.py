@@ -3,26 +3,37 @@
 import os
 import numpy as np
 from cylc_performance import * 
+from render_plots import PlotSpec, render_plots
+from rollups import DailyRollups
+import task_metrics
 
-def generate_plots(data_dir='.', plot_dir='.'):
+def generate_plots(data_dir='.', plot_dir='.', store_dir=None, cache_dir=None, nprocs=None, 
+                   rollup_dir=None):
     """Generate performance plots for coupled jobs: 
     - Run time
     - Task status
     - SYPD
     - Queue time 
+    - Queue time and run time percentiles
+    Daily counts, means and percentiles are read from rollups if rollup_dir 
+    is given.
     """
     # Load data 
     suite_status = SuiteStatus(data_dir+'/suite_status.csv')     
-    coupled = CoupledData(data_dir+'/coupled_jobs.csv', suite_status)
+    cache = DerivedCache(cache_dir) if cache_dir else None
 
-    # Derive columns for plotting
-    coupled.set_filesystem() 
-    coupled.set_xios_logs()
-    coupled.reset_errors()
-    coupled.calc_metrics()
+    # Load with derived columns for plotting
+    with task_metrics.Stage('load') as stage:
+        coupled = CoupledData.load_derived(data_dir+'/coupled_jobs.csv', suite_status, 
+                                           store_dir, cache=cache)
+        stage.add(rows=len(coupled.data))
+    if rollup_dir: 
+        coupled.rollups = DailyRollups.read(rollup_dir)
     
     # Write out data 
     coupled.write('coupled_jobs_plus.csv')
+    if store_dir: 
+        coupled.write_store(store_dir, 'coupled_plus')
 
     # Filter
     suites_3m = suite_status.data[suite_status.data['Cycle length (days)'] == 90].index
@@ -31,49 +42,78 @@ def generate_plots(data_dir='.', plot_dir='.'):
     setup_plots()
     
     date_string='2023-03-01'
-    coupled.plot_runtime_filesystem(
-        plot_file=plot_dir+'/coupled_runtime_all.png', 
-        title='CANARI coupled task run times since {}'.format(date_string),
-        suites=suites_3m, 
-	date_string=date_string, 
-	ms=2)
+    specs = [
+        PlotSpec('plot_runtime_filesystem', dict(
+            plot_file=plot_dir+'/coupled_runtime_all.png', 
+            title='CANARI coupled task run times since {}'.format(date_string),
+            suites=suites_3m, 
+            date_string=date_string, 
+            ms=2))]
 	
     date_string='2023-10-01'
-    coupled.plot_runtime_filesystem(
-        plot_file=plot_dir+'/coupled_runtime_from_Oct.png',
-	title='CANARI coupled task run times since {}'.format(date_string),
-        suites=suites_3m, 
-	date_string=date_string, 
-        ms=3)
-    coupled.plot_runtime_filesystem(
-        plot_file=plot_dir+'/coupled_runtime_xios_logs.png',
-	title='CANARI coupled task run times since {}'.format(date_string),
-        suites=suites_3m, 
-        date_string=date_string, 
-        ms=3, 
-        xios_logs=True)
-	
-    coupled.plot_status(
-        plot_file=plot_dir+'/coupled_status.png',
-        title='CANARI coupled task statuses each day',
-        suites=suites_3m, 
-        mean=True, 
-        hlines=[20,40,60,80])	
-    coupled.plot_sypd(
-        plot_file=plot_dir+'/coupled_sypd.png', 
-	title='CANARI SYPD for successful coupled tasks',
-	suites=suites_3m, 
-	mean=True, 
-	hlines=[0.8,1.2,1.6,2.0,2.4], 
-        y_ticks=np.arange(0.6,2.6,0.2))
-    coupled.plot_queue_time(
-        plot_file=plot_dir+'/coupled_queue_time.png', 
-        title='CANARI coupled task queue times',
-        suites=suites_3m, 
-        mean=True, 
-        hlines=[10,20,30])
+    specs += [
+        PlotSpec('plot_runtime_filesystem', dict(
+            plot_file=plot_dir+'/coupled_runtime_from_Oct.png',
+            title='CANARI coupled task run times since {}'.format(date_string),
+            suites=suites_3m, 
+            date_string=date_string, 
+            ms=3)), 
+        PlotSpec('plot_runtime_filesystem', dict(
+            plot_file=plot_dir+'/coupled_runtime_xios_logs.png',
+            title='CANARI coupled task run times since {}'.format(date_string),
+            suites=suites_3m, 
+            date_string=date_string, 
+            ms=3, 
+            xios_logs=True)), 
+        PlotSpec('plot_status', dict(
+            plot_file=plot_dir+'/coupled_status.png',
+            title='CANARI coupled task statuses each day',
+            suites=suites_3m, 
+            mean=True, 
+            hlines=[20,40,60,80])), 
+        PlotSpec('plot_sypd', dict(
+            plot_file=plot_dir+'/coupled_sypd.png', 
+            title='CANARI SYPD for successful coupled tasks',
+            suites=suites_3m, 
+            mean=True, 
+            hlines=[0.8,1.2,1.6,2.0,2.4], 
+            y_ticks=np.arange(0.6,2.6,0.2))), 
+        PlotSpec('plot_queue_time', dict(
+            plot_file=plot_dir+'/coupled_queue_time.png', 
+            title='CANARI coupled task queue times',
+            suites=suites_3m, 
+            mean=True, 
+            hlines=[10,20,30])), 
+        PlotSpec('plot_percentiles', dict(
+            plot_file=plot_dir+'/coupled_queue_time_percentiles.png', 
+            title='CANARI coupled task queue time percentiles each day',
+            y_col='Queued time (h)', 
+            y_label='Queue time (h)', 
+            suites=suites_3m, 
+            hlines=[10,20,30])), 
+        PlotSpec('plot_percentiles', dict(
+            plot_file=plot_dir+'/coupled_runtime_percentiles.png', 
+            title='CANARI successful coupled task run time percentiles each day',
+            y_col='Elapsed time (h)', 
+            y_label='Time to completion (h)', 
+            suites=suites_3m, 
+            statuses=['SUCCEEDED']))]
+
+    # Per-suite plots 
+    suite_dir = plot_dir+'/suites'
+    specs += coupled.suite_plot_specs(suite_dir)
+
+    with task_metrics.Stage('plot') as stage:
+        rendered = render_plots(specs, coupled, nprocs, manifest_file=plot_dir+'/.plot_manifest.json')
+        stage.add(files=len(rendered))
+    write_suite_index(suite_dir, suite_status)
      
 if __name__=='__main__': 
     data_dir = os.environ.get('DATA_DIR', '/gws/nopw/j04/canari/users/aosprey/log-analysis/data')
     plot_dir = os.environ.get('PLOT_DIR', '.')
-    generate_plots(data_dir=data_dir, plot_dir=plot_dir)
+    store_dir = os.environ.get('STORE_DIR') or None
+    cache_dir = os.environ.get('CACHE_DIR')
+    rollup_dir = os.environ.get('ROLLUP_DIR')
+    nprocs = int(os.environ.get('NPROCS') or 0) or None
+    generate_plots(data_dir=data_dir, plot_dir=plot_dir, store_dir=store_dir, cache_dir=cache_dir, 
+                   nprocs=nprocs, rollup_dir=rollup_dir)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+import os
+from cylc_performance import *
+from render_plots import PlotSpec, render_plots
+
+def generate_plots(metrics_file, plot_dir='.', nprocs=None):
+    """Generate run time plots for this workflow's own tasks, from the
+    pipeline metrics file:
+    - Wall time of each task
+    - Wall time and CPU time of each stage of process_logs and concat_logs
+    """
+    if not os.path.isfile(metrics_file):
+        print("Info: No pipeline metrics file, nothing to plot: ", metrics_file)
+        return
+
+    metrics = PipelineMetrics(metrics_file)
+    metrics.derive()
+    os.makedirs(plot_dir, exist_ok=True)
+
+    # Plots
+    setup_plots()
+    specs = []
+    for task in metrics.tasks():
+        specs.append(PlotSpec('plot_runtime', dict(
+            plot_file='{}/pipeline_{}_runtime.png'.format(plot_dir, task),
+            title='{} task run times'.format(task),
+            task=task,
+            mean=True)))
+    for task in ['process_logs', 'concat_logs']:
+        for stage in metrics.data.loc[metrics.data['Task'] == task, 'Stage'].unique():
+            if stage == 'task':
+                continue
+            for y_col in ['Wall time (min)', 'CPU time (min)']:
+                specs.append(PlotSpec('plot_runtime', dict(
+                    plot_file='{}/pipeline_{}_{}_{}.png'.format(
+                        plot_dir, task, stage, y_col.split()[0].lower()),
+                    title='{} {} stage {}'.format(task, stage, y_col.split(' (')[0].lower()),
+                    task=task,
+                    stage=stage,
+                    y_col=y_col,
+                    mean=True)))
+
+    render_plots(specs, metrics, nprocs)
+
+if __name__=='__main__':
+    data_dir = os.environ.get('DATA_DIR', '/gws/nopw/j04/canari/users/aosprey/log-analysis/data')
+    metrics_file = os.environ.get('PIPELINE_METRICS') or data_dir+'/pipeline_metrics.jsonl'
+    plot_dir = os.environ.get('PLOT_DIR', '.')
+    nprocs = int(os.environ.get('NPROCS') or 0) or None
+    generate_plots(metrics_file, plot_dir+'/pipeline', nprocs)
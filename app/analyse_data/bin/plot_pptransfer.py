@@ -2,33 +2,68 @@
 
 import os
 from cylc_performance import * 
+from render_plots import PlotSpec, render_plots
+from rollups import DailyRollups
+import task_metrics
 
-def generate_plots(data_dir='.', plot_dir='.'): 
+def generate_plots(data_dir='.', plot_dir='.', store_dir=None, cache_dir=None, nprocs=None, 
+                   rollup_dir=None): 
     """Generate performance plots for pptransfer jobs: 
     - Task statuses 
     - Transfer task speed
+    - Transfer task speed percentiles
+    Daily counts, means and percentiles are read from rollups if rollup_dir 
+    is given.
     """
     # Load data 
     suite_status = SuiteStatus(data_dir+'/suite_status.csv')     
-    pptransfer = PPTransferData(data_dir+'/pptransfer_jobs.csv', suite_status) 
+    columns = ['Suite id', 'Rep', 'Init time', 'Exit status', 
+               'Data size (GB)', 'Elapsed time (s)']
+    cache = DerivedCache(cache_dir) if cache_dir else None
 
-    # Calculate metrics 
-    pptransfer.calc_metrics()
+    # Load and calculate metrics 
+    with task_metrics.Stage('load') as stage:
+        pptransfer = PPTransferData.load_derived(data_dir+'/pptransfer_jobs.csv', suite_status, 
+                                                 store_dir, columns=columns, cache=cache) 
+        stage.add(rows=len(pptransfer.data))
+    if rollup_dir: 
+        pptransfer.rollups = DailyRollups.read(rollup_dir)
 
     # Plots 
     setup_plots()
-    pptransfer.plot_status(
-        plot_file=plot_dir+'/pptransfer_status.png', 
-        title='CANARI transfer task statuses each day', 
-	mean=True, 
-	hlines=[50,100,150,200])
-    pptransfer.plot_speed(
-        plot_file=plot_dir+'/pptransfer_speed.png', 
-	title='CANARI speed of successful transfer tasks', 
-	mean=True, 
-	hlines=[50,100,150,200])
+    specs = [
+        PlotSpec('plot_status', dict(
+            plot_file=plot_dir+'/pptransfer_status.png', 
+            title='CANARI transfer task statuses each day', 
+            mean=True, 
+            hlines=[50,100,150,200])), 
+        PlotSpec('plot_speed', dict(
+            plot_file=plot_dir+'/pptransfer_speed.png', 
+            title='CANARI speed of successful transfer tasks', 
+            mean=True, 
+            hlines=[50,100,150,200])), 
+        PlotSpec('plot_percentiles', dict(
+            plot_file=plot_dir+'/pptransfer_speed_percentiles.png', 
+            title='CANARI speed percentiles of successful transfer tasks each day', 
+            y_col='Speed (MB/s)', 
+            y_label='Transfer speed (MB/s)', 
+            quantiles=(0.1, 0.5, 0.9), 
+            hlines=[50,100,150,200]))]
+
+    # Per-suite plots 
+    suite_dir = plot_dir+'/suites'
+    specs += pptransfer.suite_plot_specs(suite_dir)
+
+    with task_metrics.Stage('plot') as stage:
+        rendered = render_plots(specs, pptransfer, nprocs, manifest_file=plot_dir+'/.plot_manifest.json')
+        stage.add(files=len(rendered))
+    write_suite_index(suite_dir, suite_status)
 
 if __name__=="__main__": 
     data_dir = os.environ.get('DATA_DIR', '/gws/nopw/j04/canari/users/aosprey/log-analysis/data')
     plot_dir = os.environ.get('PLOT_DIR', '.') 
-    generate_plots(data_dir, plot_dir)
+    store_dir = os.environ.get('STORE_DIR') or None
+    cache_dir = os.environ.get('CACHE_DIR')
+    rollup_dir = os.environ.get('ROLLUP_DIR')
+    nprocs = int(os.environ.get('NPROCS') or 0) or None
+    generate_plots(data_dir, plot_dir, store_dir, cache_dir, nprocs, rollup_dir)
@@ -4,6 +4,7 @@ import os
 import pandas as pd
 from matplotlib import pyplot as plt
 from datetime import datetime
+from render_plots import PlotSpec, render_plots
 
 
 def view_canari(suite_file='suite_perf.csv', plot_file='wsypd.png'):
@@ -24,9 +25,11 @@ def view_canari(suite_file='suite_perf.csv', plot_file='wsypd.png'):
 
     ax.plot(sypd,asypd,marker='*', color='red',markersize=10)
     plt.savefig(plot_file)
+    plt.close()
 
 
 if __name__=="__main__":
     stats_dir = os.environ.get('STATS_DIR', '/gws/nopw/j04/canari/public/perf_analysis/DATA')
     plot_dir = os.environ.get('PLOT_DIR', '.') 
-    view_canari(stats_dir+'/suite_perf.csv', plot_dir+'/coupled_wsypd.png')
+    render_plots([PlotSpec(view_canari, dict(suite_file=stats_dir+'/suite_perf.csv', 
+                                             plot_file=plot_dir+'/coupled_wsypd.png'))])
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+"""Query job data by suite, date range, exit status, file system and XIOS logs.
+
+e.g. queue times for u-cz568 on NVMe in September:
+
+    query_jobs.py --suite u-cz568 --start 2023-09-01 --end 2023-10-01 \\
+        --file-system NVMe --columns 'Submit time' 'Queued time (h)'
+
+Filters are (column, op, value) tuples. With the columnar store (STORE_DIR)
+they are pushed down to the Parquet reader, so only the partitions of the
+suites asked for, and row groups that may match, are read. Filters on
+derived columns (file system, XIOS logs and corrected exit status) are
+pushed down too if the store has derived data (coupled_plus, written by
+plot_coupled). Otherwise these are applied after deriving the columns for
+the jobs read. Without the store, the CSV file is read and filtered.
+"""
+
+import argparse
+import os
+import sys
+import numpy as np
+import pandas as pd
+import job_schema
+import job_store
+
+TASKS = ['coupled', 'pptransfer']
+
+
+def job_filters(suites=None, start=None, end=None, statuses=None, file_system=None,
+                xios_logs=None, time_col='Init time'):
+    """Filters for jobs of suites, with time_col from start to before end,
+    with exit statuses, file system and XIOS logs given."""
+    filters = []
+    if suites:
+        filters.append(('Suite id', 'in', list(suites)))
+    if start is not None:
+        filters.append((time_col, '>=', pd.Timestamp(start, tz='UTC')))
+    if end is not None:
+        filters.append((time_col, '<', pd.Timestamp(end, tz='UTC')))
+    if statuses:
+        filters.append(('Exit status', 'in', list(statuses)))
+    if file_system is not None:
+        filters.append(('File system', '==', file_system))
+    if xios_logs is not None:
+        filters.append(('XIOS logs', '==', xios_logs))
+    return filters
+
+
+def filter_mask(data, filters):
+    """Mask of rows of data matching filters."""
+    mask = np.ones(len(data), dtype=bool)
+    for col, op, value in filters:
+        values = data[col]
+        if op == 'in':
+            match = values.isin(value)
+        elif op == '==':
+            match = values == value
+        elif op == '>=':
+            match = values >= value
+        elif op == '<':
+            match = values < value
+        else:
+            raise ValueError('Unknown filter operator: {}'.format(op))
+        mask &= match.to_numpy(dtype=bool, na_value=False)
+    return mask
+
+
+def query(task='coupled', filters=(), columns=None, data_dir='.', store_dir=None):
+    """Jobs of a task matching filters, with derived columns.
+    Returns dataframe indexed by batch id, optionally just some columns."""
+    filters = list(filters)
+    plus_task = task+'_plus'
+    if job_store.has_task(store_dir, plus_task):
+        # Derived data is stored, so every filter can be pushed down
+        data = job_store.read_task(store_dir, plus_task, columns=columns, filters=filters)
+        return data if columns is None else data[columns]
+
+    # Only import analysis code (and matplotlib) if data needs deriving,
+    # so queries of the store are quick
+    from cylc_performance import SuiteStatus, CoupledData, PPTransferData
+    cls = {'coupled': CoupledData, 'pptransfer': PPTransferData}[task]
+
+    if job_store.has_task(store_dir, task):
+        suite_status = SuiteStatus(store_dir+'/suite_status.parquet')
+    else:
+        suite_status = SuiteStatus(data_dir+'/suite_status.csv')
+
+    # Filter on stored columns first, then on derived columns once derived
+    stored = [f for f in filters if f[0] not in cls.DERIVED_COLS]
+    if job_store.has_task(store_dir, task):
+        data = job_store.read_task(store_dir, task, filters=stored)
+    else:
+        data = job_schema.read_csv('{}/{}_jobs.csv'.format(data_dir, task),
+                                   required=job_schema.JOB_COLS+['Suite id'])
+        data = data[filter_mask(data, stored)]
+    job_data = cls(None, suite_status, data=data)
+    job_data.derive()
+    data = job_data.data[filter_mask(job_data.data, filters)]
+    return data if columns is None else data[columns]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query cylc job data.')
+    parser.add_argument('--task', choices=TASKS, default='coupled', help='Task')
+    parser.add_argument('--suite', nargs='+', help='Suite ids')
+    parser.add_argument('--start', help='First date or time (UTC)')
+    parser.add_argument('--end', help='Date or time (UTC) to stop before')
+    parser.add_argument('--time-col', default='Init time',
+                        help='Time column for --start and --end, e.g. "Submit time"')
+    parser.add_argument('--status', nargs='+', help='Exit statuses, e.g. SUCCEEDED EXIT')
+    parser.add_argument('--file-system', choices=job_schema.CATEGORIES['File system'],
+                        help='File system (coupled only)')
+    parser.add_argument('--xios-logs', choices=['on', 'off'], help='XIOS logs (coupled only)')
+    parser.add_argument('--columns', nargs='+', help='Columns to output')
+    parser.add_argument('--format', choices=['table', 'csv'], default='table',
+                        help='Output format')
+    parser.add_argument('--output', help='Output file, default stdout')
+    args = parser.parse_args()
+
+    data_dir = os.environ.get('DATA_DIR', '/gws/nopw/j04/canari/users/aosprey/log-analysis/data')
+    store_dir = os.environ.get('STORE_DIR') or None
+    xios_logs = None if args.xios_logs is None else args.xios_logs == 'on'
+    filters = job_filters(args.suite, args.start, args.end, args.status, args.file_system,
+                          xios_logs, args.time_col)
+    try:
+        data = query(args.task, filters, args.columns, data_dir, store_dir)
+    except (KeyError, ValueError) as err:
+        print("Error: query failed: {}".format(err), file=sys.stderr)
+        sys.exit(1)
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        if args.format == 'csv':
+            data.to_csv(out)
+        else:
+            out.write(data.to_string() + '\n')
+    finally:
+        if args.output:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
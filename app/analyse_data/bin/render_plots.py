@@ -0,0 +1,177 @@
+"""Render a list of plots on a pool of worker processes.
+
+Each plot is described by a PlotSpec: a plotting method name of the job data
+object (or a plotting function) and its keyword arguments, including the
+output plot_file. Plots are drawn with the non-interactive Agg backend and
+every figure is closed once saved.
+
+If a manifest file is given, a digest of each plot's input data slice and
+arguments is recorded, and plots whose inputs haven't changed since they
+were last rendered are skipped.
+"""
+
+import hashlib
+import json
+import os
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import pandas as pd
+import matplotlib.pyplot as plt
+from workers import default_nprocs
+
+PlotSpec = namedtuple('PlotSpec', ['method', 'kwargs'])
+
+# Job data shared with worker processes
+_job_data = None
+
+# Default number of workers, as the analysis runs on a shared server
+MAX_NPROCS = 4
+
+
+def spec_name(spec):
+    """Name of plotting method or function."""
+    return spec.method if isinstance(spec.method, str) else spec.method.__name__
+
+
+def spec_repr(kwargs):
+    """Stable representation of plot arguments, excluding the output file."""
+    items = []
+    for key in sorted(kwargs):
+        if key == 'plot_file':
+            continue
+        value = kwargs[key]
+        if hasattr(value, 'tolist'):
+            value = value.tolist()
+        elif hasattr(value, 'data'):
+            # Job data is hashed separately
+            value = type(value).__name__
+        items.append((key, value))
+    return repr(items)
+
+
+def frame_hashes(data, hashes):
+    """Hashes of the rows of a dataframe, cached in hashes by object id, so
+    data shared by many plots is only hashed once."""
+    key = id(data)
+    if key not in hashes:
+        hashes[key] = pd.util.hash_pandas_object(data, index=True).values
+    return hashes[key]
+
+
+def hash_job_data(digest, job_data, kwargs, hashes):
+    """Add the code of a job data object, the rows of its data a plot uses
+    and its daily rollups for the task to digest. Only a filter by suites is
+    applied to the data here."""
+    with open(sys.modules[type(job_data).__module__].__file__, 'rb') as f:
+        digest.update(f.read())
+    rows = frame_hashes(job_data.data, hashes)
+    suites = kwargs.get('suites')
+    if suites is not None:
+        rows = rows[job_data.data['Suite id'].isin(suites).to_numpy()]
+    digest.update(rows.tobytes())
+
+    rollups = getattr(job_data, 'rollups', None)
+    if rollups is not None:
+        for name in sorted(rollups.tables):
+            table = rollups.tables[name]
+            key = (id(table), job_data.task_name)
+            if key not in hashes:
+                # Not the index, which depends on rows of other suites
+                table = table[table['Task'] == job_data.task_name]
+                hashes[key] = pd.util.hash_pandas_object(table, index=False).values
+            digest.update(hashes[key].tobytes())
+
+
+def spec_digest(spec, job_data=None, hashes=None):
+    """Digest of a plot's code, arguments and input data. A plotting
+    method uses job_data, a plotting function the files and job data
+    passed to it, e.g. the data for a single suite.
+    hashes caches row hashes of data shared between specs."""
+    hashes = {} if hashes is None else hashes
+    digest = hashlib.sha1(spec_name(spec).encode())
+    digest.update(spec_repr(spec.kwargs).encode())
+    if isinstance(spec.method, str):
+        hash_job_data(digest, job_data, spec.kwargs, hashes)
+    else:
+        # Hash content of any input files or job data passed to a plotting function
+        for key in sorted(spec.kwargs):
+            value = spec.kwargs[key]
+            if key != 'plot_file' and isinstance(value, str) and os.path.isfile(value):
+                with open(value, 'rb') as f:
+                    digest.update(f.read())
+            elif isinstance(getattr(value, 'data', None), pd.DataFrame):
+                hash_job_data(digest, value, {}, hashes)
+    return digest.hexdigest()
+
+
+def read_manifest(manifest_file):
+    """Read digests of previously rendered plots."""
+    if manifest_file is not None and os.path.isfile(manifest_file):
+        with open(manifest_file) as f:
+            return json.load(f)
+    return {}
+
+
+def write_manifest(manifest_file, manifest):
+    """Write digests of rendered plots."""
+    tmp_file = manifest_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, manifest_file)
+
+
+def _init_worker(job_data):
+    """Set up plotting in a worker process."""
+    global _job_data
+    _job_data = job_data
+    plt.switch_backend('Agg')
+
+
+def render_plot(spec):
+    """Draw a single plot and close its figures."""
+    if isinstance(spec.method, str):
+        getattr(_job_data, spec.method)(**spec.kwargs)
+    else:
+        spec.method(**spec.kwargs)
+    plt.close('all')
+    return spec.kwargs['plot_file']
+
+
+def render_plots(specs, job_data=None, nprocs=None, manifest_file=None):
+    """Render plots on a pool of up to nprocs worker processes, skipping
+    plots with unchanged inputs if a manifest file is given.
+    Returns list of plot files rendered."""
+    manifest = read_manifest(manifest_file)
+    hashes = {}
+    todo = []
+    for spec in specs:
+        plot_file = spec.kwargs['plot_file']
+        digest = spec_digest(spec, job_data, hashes) if manifest_file is not None else None
+        if digest is not None and manifest.get(plot_file) == digest and os.path.isfile(plot_file):
+            print("Unchanged: ", plot_file)
+            continue
+        todo.append((spec, digest))
+
+    if not todo:
+        return []
+
+    # Fork so workers share the job data and plot settings without copying
+    nprocs = min(nprocs or default_nprocs(MAX_NPROCS), len(todo))
+    context = multiprocessing.get_context('fork')
+    rendered = []
+    with ProcessPoolExecutor(max_workers=nprocs, mp_context=context,
+                             initializer=_init_worker,
+                             initargs=(job_data,)) as pool:
+        futures = [(digest, pool.submit(render_plot, spec)) for spec, digest in todo]
+        for digest, future in futures:
+            plot_file = future.result()
+            print("Rendered: ", plot_file)
+            rendered.append(plot_file)
+            if digest is not None:
+                manifest[plot_file] = digest
+
+    if manifest_file is not None:
+        write_manifest(manifest_file, manifest)
+    return rendered
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+import hashlib
+import json
+import os
+import pandas as pd
+import cylc_performance
+from cylc_performance import *
+import rollups
+from rollups import update_rollups
+import job_schema
+import job_store
+import task_metrics
+
+# Watermarks of the processed files last rolled up, for each task and suite,
+# and a digest of the suite status file and code they were rolled up with
+SOURCES_FILE = 'rollup_sources.json'
+
+
+def concat_watermarks(data_dir, task):
+    """Size, mtime and digest of each suite's processed file when concat_logs
+    last read it, from its incremental state, or None if there isn't any.
+    concat_logs removes its state when it rebuilds its output in full."""
+    state_file = '{}/concat/{}_state.json'.format(data_dir, task)
+    if not os.path.isfile(state_file):
+        return None
+    with open(state_file) as f:
+        state = json.load(f)
+    return {suite: [mark['size'], mark['mtime'], mark['digest']]
+            for suite, mark in state['suites'].items()}
+
+
+def sources_digest(suite_status_file):
+    """Digest of the suite status file and the code that derives and rolls
+    up job data. If it changes, all suites are rolled up again."""
+    digest = hashlib.sha1()
+    for path in [suite_status_file, __file__, cylc_performance.__file__,
+                 rollups.__file__, job_schema.__file__]:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def read_sources(rollup_dir):
+    """Watermarks of the processed files last rolled up, and the digest
+    they were rolled up with."""
+    path = os.path.join(rollup_dir, SOURCES_FILE)
+    if not os.path.isfile(path):
+        return {'digest': None, 'tasks': {}}
+    with open(path) as f:
+        sources = json.load(f)
+    if 'tasks' not in sources:
+        # Written before the digest was recorded
+        return {'digest': None, 'tasks': {}}
+    return sources
+
+
+def write_sources(rollup_dir, sources):
+    path = os.path.join(rollup_dir, SOURCES_FILE)
+    os.makedirs(rollup_dir, exist_ok=True)
+    with open(path+'.tmp', 'w') as f:
+        json.dump(sources, f)
+    os.replace(path+'.tmp', path)
+
+
+def load_suites(cls, data_dir, suite_status, suites, store_dir=None):
+    """Load and derive job data for just some suites, from the store if it
+    has the task, otherwise from the suites' processed files."""
+    if job_store.has_task(store_dir, cls.TASK):
+        job_data = cls(None, suite_status, store_dir, suites=suites)
+    else:
+        frames = []
+        for suite in suites:
+            frame = job_schema.read_csv('{}/processed/{}/{}_cylc.csv'.format(
+                data_dir, suite, cls.TASK))
+            frame['Suite id'] = suite
+            frames.append(frame)
+        job_data = cls(None, suite_status, data=job_schema.apply_schema(pd.concat(frames)))
+    job_data.derive()
+    return job_data
+
+
+def generate_rollups(data_dir='.', rollup_dir='./rollups', store_dir=None, cache_dir=None):
+    """Update daily rollups of coupled and pptransfer jobs:
+    - Number of jobs by exit status
+    - Run time, queue time and SYPD of coupled jobs
+    - Transfer speed of pptransfer jobs
+    Only suites and days with new or changed jobs are rolled up again.
+    If concat_logs is incremental, only the suites whose processed files
+    it has read since the last rollup are loaded, otherwise all jobs are.
+    All jobs are also loaded if the suite status file or the code has
+    changed since the last rollup.
+    """
+    # Load data
+    suite_status = SuiteStatus(data_dir+'/suite_status.csv')
+    cache = DerivedCache(cache_dir) if cache_dir else None
+    sources = read_sources(rollup_dir)
+    digest = sources_digest(suite_status.file)
+    if sources['digest'] != digest:
+        sources = {'digest': digest, 'tasks': {}}
+
+    for cls, csv_file in [(CoupledData, 'coupled_jobs.csv'), (PPTransferData, 'pptransfer_jobs.csv')]:
+        with task_metrics.Stage('rollup_'+cls.TASK) as stage:
+            watermarks = concat_watermarks(data_dir, cls.TASK)
+            old = sources['tasks'].get(cls.TASK)
+            if watermarks is None or old is None:
+                job_data = cls.load_derived(data_dir+'/'+csv_file, suite_status, store_dir, cache=cache)
+                count = update_rollups(job_data, rollup_dir)
+                if watermarks is None:
+                    sources['tasks'].pop(cls.TASK, None)
+                else:
+                    sources['tasks'][cls.TASK] = watermarks
+            else:
+                changed = [suite for suite in watermarks if old.get(suite) != watermarks[suite]]
+                removed = [suite for suite in old if suite not in watermarks]
+                count = 0
+                if changed:
+                    job_data = load_suites(cls, data_dir, suite_status, changed, store_dir)
+                    count += update_rollups(job_data, rollup_dir, changed)
+                    stage.add(files=len(changed))
+                if removed:
+                    no_jobs = pd.DataFrame(columns=['Suite id'] + job_schema.JOB_COLS)
+                    job_data = cls(None, suite_status, data=job_schema.apply_schema(no_jobs))
+                    count += update_rollups(job_data, rollup_dir, removed)
+                sources['tasks'][cls.TASK] = watermarks
+            stage.add(rows=count)
+        print("Rolled up {}: {} new or changed suite days".format(cls.TASK, count))
+    write_sources(rollup_dir, sources)
+
+if __name__=='__main__':
+    data_dir = os.environ.get('DATA_DIR', '/gws/nopw/j04/canari/users/aosprey/log-analysis/data')
+    rollup_dir = os.environ.get('ROLLUP_DIR', data_dir+'/rollups')
+    store_dir = os.environ.get('STORE_DIR') or None
+    cache_dir = os.environ.get('CACHE_DIR')
+    generate_rollups(data_dir, rollup_dir, store_dir, cache_dir)
@@ -0,0 +1,335 @@
+"""Daily rollups of job data, for time series plots.
+
+Three tables are kept in the rollup dir, for all tasks:
+  status_daily.csv: number of jobs per task, suite, day and exit status,
+      with the latest cycle and the exit time of its job.
+  metrics_daily.csv: count, sum, min, max and a quantile sketch of each
+      metric per task, suite, day and exit status.
+  rollup_state.csv: a fingerprint of the jobs on each suite and day.
+Days are by init time, unless a task's metric is plotted against another
+time (e.g. queue time, by submit time). Only days whose fingerprints have
+changed are rolled up again, so an update touches just the new days.
+
+Sketches are log-binned histograms (as in DDSketch) with quantiles within
+SKETCH_ACCURACY of the true value. They are stored as "bin:count" pairs and
+merged by adding counts, so quantiles can be found over any suites or days.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import job_schema
+
+STATUS_FILE = 'status_daily.csv'
+METRICS_FILE = 'metrics_daily.csv'
+STATE_FILE = 'rollup_state.csv'
+
+# Day of each job, for status counts and metrics without their own date column
+STATUS_DATE_COL = 'Init time'
+
+KEY_COLS = ['Task', 'Suite id', 'Date', 'Exit status']
+STATUS_COLS = KEY_COLS + ['Jobs', 'Last cycle', 'Last cycle exit time']
+METRIC_COLS = ['Task', 'Suite id', 'Metric', 'Date', 'Exit status',
+               'Count', 'Sum', 'Min', 'Max', 'Sketch']
+STATE_COLS = ['Task', 'Date column', 'Suite id', 'Date', 'Fingerprint']
+
+SKETCH_ACCURACY = 0.01
+_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+# Bin for zero and negative values
+ZERO_BIN = -(1 << 30)
+
+
+# Sketches
+
+def sketch_bins(values):
+    """Sketch bin of each value."""
+    values = np.asarray(values, dtype='float64')
+    bins = np.full(values.shape, ZERO_BIN, dtype='int64')
+    positive = values > 0
+    bins[positive] = np.ceil(np.log(values[positive]) / np.log(_GAMMA))
+    return bins
+
+
+def bin_value(b):
+    """Representative value of a sketch bin."""
+    if b == ZERO_BIN:
+        return 0.0
+    return 2 * _GAMMA**b / (_GAMMA + 1)
+
+
+def merge_sketches(sketches):
+    """Merge sketch strings into a dict of {bin: count}."""
+    merged = {}
+    for sketch in sketches:
+        if not isinstance(sketch, str):
+            continue
+        for pair in sketch.split():
+            b, count = pair.split(':')
+            merged[int(b)] = merged.get(int(b), 0) + int(count)
+    return merged
+
+
+def sketch_quantile(sketch, q):
+    """Value at quantile q of a merged sketch, or NaN if it's empty."""
+    total = sum(sketch.values())
+    if total == 0:
+        return np.nan
+    rank = q * (total - 1)
+    seen = 0
+    for b in sorted(sketch):
+        seen += sketch[b]
+        if seen > rank:
+            return bin_value(b)
+    return bin_value(max(sketch))
+
+
+# Building and updating rollups
+
+def empty_tables():
+    """Rollup tables with no rows."""
+    return typed_tables({'status': pd.DataFrame(columns=STATUS_COLS),
+                         'metrics': pd.DataFrame(columns=METRIC_COLS),
+                         'state': pd.DataFrame(columns=STATE_COLS)})
+
+
+def as_dates(values):
+    """Dates as naive datetimes, at the same resolution wherever read."""
+    return pd.to_datetime(values).astype('datetime64[ns]')
+
+
+def job_days(times):
+    """Day of each job time (UTC), as naive dates."""
+    return as_dates(times.dt.tz_convert(None).dt.floor('D'))
+
+
+def typed_tables(tables):
+    """Convert columns of rollup tables to their types."""
+    for table in tables.values():
+        table['Date'] = as_dates(table['Date'])
+        if 'Exit status' in table.columns:
+            table['Exit status'] = table['Exit status'].fillna('')
+    status, metrics = tables['status'], tables['metrics']
+    status['Last cycle'] = job_schema.as_cycles(status['Last cycle'])
+    status['Last cycle exit time'] = pd.to_datetime(status['Last cycle exit time'], utc=True)
+    status['Jobs'] = status['Jobs'].astype('int64')
+    metrics['Count'] = metrics['Count'].astype('int64')
+    for col in ['Sum', 'Min', 'Max']:
+        metrics[col] = metrics[col].astype('float64')
+    return tables
+
+
+def read_tables(rollup_dir):
+    """Read rollup tables, or empty tables if there aren't any yet."""
+    tables = {}
+    files = {'status': (STATUS_FILE, STATUS_COLS), 'metrics': (METRICS_FILE, METRIC_COLS),
+             'state': (STATE_FILE, STATE_COLS)}
+    for name, (file, cols) in files.items():
+        path = os.path.join(rollup_dir, file)
+        if os.path.isfile(path):
+            tables[name] = pd.read_csv(path, keep_default_na=False, na_values=[''],
+                                       float_precision='round_trip',
+                                       dtype={'Exit status': str, 'Fingerprint': str,
+                                              'Sketch': str, 'Last cycle': str})
+        else:
+            tables[name] = pd.DataFrame(columns=cols)
+    return typed_tables(tables)
+
+
+def write_tables(rollup_dir, tables):
+    """Write rollup tables. State is written last, so if anything fails the
+    same days are rolled up again next time."""
+    os.makedirs(rollup_dir, exist_ok=True)
+    for name, file in [('status', STATUS_FILE), ('metrics', METRICS_FILE), ('state', STATE_FILE)]:
+        path = os.path.join(rollup_dir, file)
+        table = tables[name].assign(Date=tables[name]['Date'].dt.strftime('%Y-%m-%d'))
+        table.to_csv(path+'.tmp', index=False)
+        os.replace(path+'.tmp', path)
+
+
+def has_task(tables, task):
+    """Whether rollup tables have any days for a task."""
+    return (tables['state']['Task'] == task).any()
+
+
+def day_fingerprints(suites, days, hashes):
+    """Fingerprint of the jobs on each suite and day: sum of row hashes
+    and number of jobs."""
+    sums = pd.DataFrame({'Suite id': suites, 'Date': days, 'Hash': hashes}).groupby(
+        ['Suite id', 'Date'])['Hash'].agg(['sum', 'count'])
+    fingerprints = sums['sum'].astype(str) + '-' + sums['count'].astype(str)
+    return fingerprints.rename('Fingerprint').reset_index()
+
+
+def in_days(frame, days):
+    """Mask of rows of frame on (suite, day) pairs in days."""
+    keys = pd.MultiIndex.from_arrays([frame['Suite id'], frame['Date']])
+    return keys.isin(pd.MultiIndex.from_frame(days[['Suite id', 'Date']]))
+
+
+def roll_up_status(task, frame):
+    """Count jobs per suite, day and exit status, and find the latest cycle."""
+    frame = frame.sort_values(['Cycle', 'Exit time'])
+    rollup = frame.groupby(KEY_COLS[1:]).agg(**{
+        'Jobs': ('Exit status', 'size'),
+        'Last cycle': ('Cycle', 'last'),
+        'Last cycle exit time': ('Exit time', 'last')}).reset_index()
+    rollup.insert(0, 'Task', task)
+    return rollup[STATUS_COLS]
+
+
+def roll_up_metric(task, metric, frame):
+    """Count, sum, min, max and sketch of a metric per suite, day and exit status."""
+    keys = KEY_COLS[1:]
+    rollup = frame.groupby(keys)['Value'].agg(
+        Count='count', Sum='sum', Min='min', Max='max')
+
+    valid = frame[frame['Value'].notna()]
+    counts = valid.groupby(keys + [sketch_bins(valid['Value'])]).size().reset_index(name='n')
+    bins = counts.columns[len(keys)]
+    pairs = counts[bins].astype(str) + ':' + counts['n'].astype(str)
+    sketches = pairs.groupby([counts[k] for k in keys]).agg(' '.join)
+    rollup['Sketch'] = sketches.reindex(rollup.index).fillna('')
+
+    rollup = rollup.reset_index()
+    rollup.insert(0, 'Task', task)
+    rollup.insert(2, 'Metric', metric)
+    return rollup[METRIC_COLS]
+
+
+def roll_up(job_data, tables, suites=None):
+    """Update rollup tables for a task with its job data. Only suites and days
+    whose jobs have changed are rolled up again. If suites is given, job data
+    is for just those suites, and rollups of other suites are kept. Suites
+    given with no jobs are removed.
+    Returns (updated tables, number of suite days rolled up)."""
+    task = job_data.task_name
+    data = job_data.data
+    metrics = {metric: date_col for metric, date_col in job_data.ROLLUP_METRICS.items()
+               if metric in data.columns}
+    date_cols = sorted({STATUS_DATE_COL} | set(metrics.values()))
+
+    # Exit status is '' if it isn't known, so those jobs still have a group
+    base = pd.DataFrame({'Suite id': np.asarray(data['Suite id'].astype(str)),
+                         'Exit status': np.asarray(data['Exit status'].astype(object).fillna(''))})
+    hashes = (pd.util.hash_pandas_object(data, index=True).values >> np.uint64(12)).astype('int64')
+
+    status, metric_table, state = tables['status'], tables['metrics'], tables['state']
+    count = 0
+    if suites is not None:
+        # Remove suites given that have no jobs
+        gone = set(suites).difference(base['Suite id'])
+        status = status[~((status['Task'] == task) & status['Suite id'].isin(gone))]
+        metric_table = metric_table[~((metric_table['Task'] == task) &
+                                      metric_table['Suite id'].isin(gone))]
+        drop = (state['Task'] == task) & state['Suite id'].isin(gone)
+        count += int((drop & (state['Date column'] == STATUS_DATE_COL)).sum())
+        state = state[~drop]
+    for date_col in date_cols:
+        days = job_days(data[date_col]).to_numpy()
+        fingerprints = day_fingerprints(base['Suite id'], days, hashes)
+        fingerprints.insert(0, 'Task', task)
+        fingerprints.insert(1, 'Date column', date_col)
+
+        # Suite days that are new, changed or gone
+        old = (state['Task'] == task) & (state['Date column'] == date_col)
+        if suites is not None:
+            old &= state['Suite id'].isin(list(suites))
+        compare = fingerprints.merge(state[old], how='outer', on=STATE_COLS[:4],
+                                     suffixes=('', ' old'))
+        changed = compare[compare['Fingerprint'] != compare['Fingerprint old']]
+        state = pd.concat([state[~old], fingerprints], ignore_index=True)
+        if changed.empty:
+            continue
+        count += len(changed)
+
+        frame = base.assign(Date=days)
+        rows = in_days(frame, changed)
+        frame = frame[rows]
+        if date_col == STATUS_DATE_COL:
+            frame = frame.assign(Cycle=data['Cycle'].array[rows],
+                                 **{'Exit time': data['Exit time'].array[rows]})
+            drop = (status['Task'] == task) & in_days(status, changed)
+            status = pd.concat([status[~drop], roll_up_status(task, frame)],
+                               ignore_index=True)
+        for metric in [m for m, col in metrics.items() if col == date_col]:
+            values = data[metric].to_numpy(dtype='float64', na_value=np.nan)[rows]
+            drop = ((metric_table['Task'] == task) & (metric_table['Metric'] == metric) &
+                    in_days(metric_table, changed))
+            metric_table = pd.concat(
+                [metric_table[~drop], roll_up_metric(task, metric, frame.assign(Value=values))],
+                ignore_index=True)
+
+    tables = {'status': status.sort_values(STATUS_COLS[:4], ignore_index=True),
+              'metrics': metric_table.sort_values(METRIC_COLS[:5], ignore_index=True),
+              'state': state.sort_values(STATE_COLS[:4], ignore_index=True)}
+    return typed_tables(tables), count
+
+
+def update_rollups(job_data, rollup_dir, suites=None):
+    """Update rollups on disk for a task with its job data, optionally for
+    just some suites, as roll_up.
+    Returns number of suite days rolled up."""
+    tables, count = roll_up(job_data, read_tables(rollup_dir), suites)
+    if count > 0:
+        write_tables(rollup_dir, tables)
+    return count
+
+
+# Reading rollups
+
+class DailyRollups:
+    """Daily rollups of job data, for all tasks."""
+
+    def __init__(self, tables):
+        self.status = tables['status']
+        self.metrics = tables['metrics']
+        self.tables = tables
+
+    @classmethod
+    def read(cls, rollup_dir):
+        """Read rollups from rollup dir."""
+        return cls(read_tables(rollup_dir))
+
+    def has_task(self, task):
+        """Whether there are rollups for a task."""
+        return has_task(self.tables, task)
+
+    def by_suite(self):
+        """Rollups for each suite, as {suite: DailyRollups}."""
+        suites = {}
+        for name, table in self.tables.items():
+            for suite, rows in table.groupby('Suite id'):
+                suites.setdefault(suite, empty_tables())[name] = rows
+        return {suite: DailyRollups(tables) for suite, tables in suites.items()}
+
+    @staticmethod
+    def select(table, task, suites=None, statuses=None):
+        """Rows of a table for a task, optionally just some suites and exit statuses."""
+        rows = table['Task'] == task
+        if suites is not None:
+            rows &= table['Suite id'].isin(list(suites))
+        if statuses is not None:
+            rows &= table['Exit status'].isin(list(statuses))
+        return table[rows]
+
+    def metric_rows(self, task, metric, suites=None, statuses=None):
+        """Rows for a metric."""
+        table = self.metrics[self.metrics['Metric'] == metric]
+        return self.select(table, task, suites, statuses)
+
+    def status_by_date(self, task, suites=None):
+        """Number of jobs by day and exit status, as from value_counts."""
+        rows = self.select(self.status, task, suites)
+        rows = rows[rows['Exit status'] != '']
+        counts = rows.groupby(['Date', 'Exit status'])['Jobs'].sum()
+        return counts.rename('count')
+
+    def daily_mean(self, task, metric, suites=None, statuses=None):
+        """Mean of a metric each day."""
+        sums = self.metric_rows(task, metric, suites, statuses).groupby('Date')[['Sum', 'Count']].sum()
+        return (sums['Sum'] / sums['Count'].where(sums['Count'] > 0)).rename(metric)
+
+    def daily_quantile(self, task, metric, q, suites=None, statuses=None):
+        """Quantile q of a metric each day, from the sketches."""
+        sketches = self.metric_rows(task, metric, suites, statuses).groupby('Date')['Sketch']
+        return sketches.agg(lambda s: sketch_quantile(merge_sketches(s), q)).rename(metric)
@@ -0,0 +1,169 @@
+"""Running performance stats for each suite, updated from new jobs only.
+
+The state file holds, for each suite, a watermark of its processed coupled
+job file (size, mtime and digest, as in concat_logs) and running aggregates
+of its successful jobs:
+  - sum and count of elapsed times, in total and for each day
+  - the latest cycle completed, as cycle point
+  - the latest exit time
+If a processed file has only grown, just the new rows are read. If it has
+been rewritten, or the suite's cycle length changes, the suite's aggregates
+are rebuilt from its file.
+
+Tasks that update the same state file, e.g. performance_stats and watch_logs,
+hold an exclusive lock on it (state_lock) from loading it until it's saved.
+"""
+
+import contextlib
+import copy
+import fcntl
+import io
+import json
+import os
+import pandas as pd
+import job_schema
+from watermarks import file_digest
+
+
+def latest(value, values):
+    """Latest of a timestamp (ISO string or None) and a series of timestamps,
+    as ISO string."""
+    times = values.dropna()
+    if value is not None:
+        times = pd.concat([times, pd.Series([pd.Timestamp(value)])])
+    return times.max().isoformat() if len(times) else None
+
+
+def latest_cycle(cycle, cycles):
+    """Latest of a cycle point (or None) and a series of cycle points."""
+    cycles = job_schema.as_cycles(cycles).dropna().tolist()
+    if cycle is not None:
+        cycles += job_schema.as_cycles(pd.Series([cycle])).tolist()
+    return max(cycles) if cycles else None
+
+
+@contextlib.contextmanager
+def state_lock(state_file):
+    """Hold an exclusive lock on a state file, waiting for any other holder."""
+    os.makedirs(os.path.dirname(os.path.abspath(state_file)), exist_ok=True)
+    with open(state_file + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class SuiteStats:
+    """Running aggregates of successful jobs for each suite."""
+
+    def __init__(self, state_file, task='coupled'):
+        self.state_file = state_file
+        self.task = task
+        self.suites = {}
+        if os.path.isfile(state_file):
+            with open(state_file) as f:
+                self.suites = json.load(f)
+
+    def save(self):
+        """Write state file."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_file)), exist_ok=True)
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.suites, f)
+        os.replace(tmp_file, self.state_file)
+
+    @staticmethod
+    def new_entry(settings):
+        """Aggregates for a suite with no jobs read yet."""
+        return {'size': 0, 'mtime': 0, 'digest': None,
+                'settings': settings, 'sum': 0.0, 'count': 0, 'days': {},
+                'last cycle': None, 'last exit time': None}
+
+    def add_jobs(self, entry, jobs):
+        """Add successful jobs to a suite's aggregates."""
+        jobs = jobs[jobs['Exit status'] == 'SUCCEEDED']
+        elapsed = jobs['Elapsed time (s)'].astype('float64')
+        entry['sum'] += float(elapsed.sum())
+        entry['count'] += int(elapsed.count())
+        days = jobs['Init time'].dt.strftime('%Y-%m-%d')
+        for day, values in elapsed.groupby(days):
+            total, count = entry['days'].get(day, [0.0, 0])
+            entry['days'][day] = [total + float(values.sum()), count + int(values.count())]
+        entry['last cycle'] = latest_cycle(entry['last cycle'], jobs['Cycle'])
+        entry['last exit time'] = latest(entry['last exit time'], jobs['Exit time'])
+
+    def update(self, proc_dir, suite_status, derive=None):
+        """Update aggregates from processed job files of suites in suite status.
+        derive(jobs) corrects new jobs before they're added, e.g. their exit
+        status. Returns list of suites updated."""
+        updated = []
+        for suite in [suite for suite in self.suites if suite not in suite_status.suites]:
+            del self.suites[suite]
+
+        for suite in suite_status.suites:
+            logfile = '{}/{}/{}_cylc.csv'.format(proc_dir, suite, self.task)
+            if not os.path.isfile(logfile):
+                continue
+            stat = os.stat(logfile)
+            settings = str(suite_status.data.loc[suite, 'Cycle length (days)'])
+            prev = self.suites.get(suite)
+            if (prev is not None and prev['settings'] == settings and
+                prev['size'] == stat.st_size and prev['mtime'] == stat.st_mtime_ns):
+                continue
+
+            try:
+                with open(logfile) as f:
+                    header = f.readline()
+                    if (prev is not None and prev['settings'] == settings and
+                        stat.st_size >= prev['size'] > 0 and
+                        file_digest(logfile, prev['size']) == prev['digest']):
+                        # Only new rows added, read these
+                        entry = copy.deepcopy(prev)
+                        f.seek(prev['size'])
+                    else:
+                        entry = self.new_entry(settings)
+                    text = header + f.read()
+                jobs = job_schema.read_csv(io.StringIO(text))
+                jobs['Suite id'] = suite
+                if derive is not None:
+                    jobs = derive(jobs)
+                self.add_jobs(entry, jobs)
+            except Exception as err:
+                print("Error: failed to update stats for {}: {}".format(suite, err))
+                continue
+
+            entry['size'] = stat.st_size
+            entry['mtime'] = stat.st_mtime_ns
+            entry['digest'] = file_digest(logfile, stat.st_size)
+            self.suites[suite] = entry
+            updated.append(suite)
+        return updated
+
+    def aggregates(self, window=None):
+        """Mean elapsed time, last completed cycle and end time for each suite.
+        With a window (days), also the mean elapsed time of jobs started in
+        the last window days the suite ran."""
+        rows = {}
+        for suite, entry in self.suites.items():
+            row = {'Mean elapsed time (s)': entry['sum'] / entry['count'] if entry['count'] else None,
+                   'Last completed cycle': entry['last cycle'],
+                   'End time': entry['last exit time']}
+            if window and entry['days']:
+                last_day = pd.Timestamp(max(entry['days']))
+                first_day = (last_day - pd.Timedelta(days=window-1)).strftime('%Y-%m-%d')
+                recent = [values for day, values in entry['days'].items() if day >= first_day]
+                count = sum(count for _, count in recent)
+                if count:
+                    row['Window mean elapsed time (s)'] = sum(total for total, _ in recent) / count
+            rows[suite] = row
+        columns = ['Mean elapsed time (s)', 'Last completed cycle', 'End time']
+        if window:
+            columns.append('Window mean elapsed time (s)')
+        data = pd.DataFrame.from_dict(rows, orient='index', columns=columns)
+        data.index.name = 'Suite id'
+        for col in columns[:1] + columns[3:]:
+            data[col] = data[col].astype('float64')
+        data['Last completed cycle'] = job_schema.as_cycles(data['Last completed cycle'])
+        data['End time'] = pd.to_datetime(data['End time'], utc=True)
+        return data
@@ -0,0 +1,187 @@
+"""Code for extracting job data from cylc workflow databases.
+
+Reads the task_jobs table of a workflow's log/db SQLite database, either
+live or an rsynced copy, and writes one CSV row per job with the same
+columns as extract_job_data, so the files are processed in the same way.
+
+Cylc inserts a row when a job is submitted and updates it until the job
+finishes, so finished jobs don't change. For each (suite, task) a
+watermark is kept next to the raw file (<task>_cylc_db.json): the rowid of
+the first job not yet finished, the number of jobs and the size of the raw
+file before it. Each update reads only the jobs from the watermark on, with
+one query on the rowid, rewrites the raw file from that point and moves the
+watermark on. If the database has been replaced, e.g. the workflow was
+reinstalled, the last job read before the watermark or the number of jobs
+before it differ, and the raw file is rebuilt. Jobs before the watermark
+changed in place aren't noticed, as cylc doesn't change finished jobs.
+
+A job that was submitted but never ran, and was then resubmitted, won't
+change, so doesn't hold the watermark back. One that is still waiting to
+run, e.g. in a stopped workflow, does: the jobs from it on are read again
+on each update until it finishes.
+
+Suites are read concurrently with asyncio, each query running on a pool of
+threads.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from cylc_job_logs import data_header, job_data_row, read_data_size
+
+# Columns read from task_jobs, the job id column is named for the cylc version
+JOB_QUERY = ('SELECT rowid, cycle, submit_num, {}, time_submit_exit, time_run, '
+             'time_run_exit, run_status, run_signal, submit_status '
+             'FROM task_jobs WHERE rowid >= ? AND name = ? ORDER BY rowid')
+
+# Job id column in cylc 8, then cylc 7
+JOB_ID_COLUMNS = ['job_id', 'batch_sys_job_id']
+
+
+def state_path(out_file):
+    """Watermark file kept alongside a job data CSV file."""
+    return os.path.splitext(out_file)[0] + '_db.json'
+
+
+def connect(db_file):
+    """Open a workflow database read only, so a live workflow isn't affected."""
+    uri = 'file:{}?mode=ro'.format(quote(os.path.abspath(db_file)))
+    return sqlite3.connect(uri, uri=True, timeout=30)
+
+
+def job_id_column(conn):
+    """Name of the batch job id column of task_jobs."""
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(task_jobs)')]
+    for column in JOB_ID_COLUMNS:
+        if column in columns:
+            return column
+    raise ValueError('No job id column in task_jobs table')
+
+
+def finished(job, last_submit):
+    """Whether a job has exited, failed to submit or been resubmitted, so
+    won't change. last_submit is the last submit num of each cycle."""
+    return (job['run_status'] is not None or job['submit_status'] not in (None, 0) or
+            job['submit_num'] < last_submit[job['cycle']])
+
+
+def job_status(job):
+    """Job status variables for a task_jobs row, as in job.status."""
+    if job['run_status'] == 0:
+        exit_status = 'SUCCEEDED'
+    else:
+        exit_status = job['run_signal'] or ''
+    return {'CYLC_BATCH_SYS_JOB_ID': job['job_id'] or '',
+            'CYLC_BATCH_SYS_JOB_SUBMIT_TIME': job['time_submit_exit'] or '',
+            'CYLC_JOB_INIT_TIME': job['time_run'] or '',
+            'CYLC_JOB_EXIT_TIME': job['time_run_exit'] or '',
+            'CYLC_JOB_EXIT': exit_status}
+
+
+def read_db_jobs(db_file, task, rowid=0, last=None, count=None):
+    """Read jobs of a task from rowid on, as dicts.
+    last is (rowid, cycle, submit num) of a job read before, and count the
+    number of jobs of the task before rowid. None is returned instead if
+    that job has gone or the count differs, i.e. the database was replaced."""
+    conn = connect(db_file)
+    try:
+        if last is not None:
+            row = conn.execute('SELECT rowid FROM task_jobs WHERE cycle = ? AND name = ? '
+                               'AND submit_num = ?', (last[1], task, last[2])).fetchone()
+            if row is None or row[0] != last[0]:
+                return None
+        if count is not None:
+            row = conn.execute('SELECT COUNT(*) FROM task_jobs WHERE rowid < ? AND name = ?',
+                               (rowid, task)).fetchone()
+            if row[0] != count:
+                return None
+        keys = ['rowid', 'cycle', 'submit_num', 'job_id', 'time_submit_exit', 'time_run',
+                'time_run_exit', 'run_status', 'run_signal', 'submit_status']
+        cursor = conn.execute(JOB_QUERY.format(job_id_column(conn)), (rowid, task))
+        return [dict(zip(keys, row)) for row in cursor]
+    finally:
+        conn.close()
+
+
+def job_data_size(log_dir, task, cycle, rep):
+    """Data size from a pptransfer job.out in log_dir, if there is one."""
+    if task != 'pptransfer' or log_dir is None:
+        return ''
+    job_out = os.path.join(log_dir, 'job', cycle, task, rep, 'job.out')
+    if os.path.isfile(job_out):
+        return read_data_size(job_out)
+    return ''
+
+
+def extract_db_job_data(db_file, task, out_file, log_dir=None, counts=None):
+    """Write batch id, submit time, start time, end time and exit status for
+    jobs of task in a workflow database to out_file, reading only jobs from
+    the watermark on. For pptransfer the data size is read from job.out in
+    log_dir, if given. If counts is given, one file and the size of the
+    database are added to counts['files'] and counts['bytes'].
+    Returns number of jobs read."""
+    state_file = state_path(out_file)
+    state = None
+    if os.path.isfile(state_file) and os.path.isfile(out_file):
+        with open(state_file) as f:
+            state = json.load(f)
+        if 'count' not in state or os.path.getsize(out_file) < state['offset']:
+            state = None
+
+    jobs = None
+    if state is not None:
+        jobs = read_db_jobs(db_file, task, state['rowid'], state['last'], state['count'])
+    if jobs is None:
+        # No watermark, or database replaced, so read all jobs
+        state = {'rowid': 0, 'count': 0, 'offset': 0, 'last': None}
+        jobs = read_db_jobs(db_file, task)
+    if counts is not None:
+        counts['files'] = counts.get('files', 0) + 1
+        counts['bytes'] = counts.get('bytes', 0) + os.path.getsize(db_file)
+
+    # Rewrite raw file from the watermark on
+    if state['offset'] == 0:
+        with open(out_file, 'w') as out:
+            out.write(data_header(task))
+    else:
+        os.truncate(out_file, state['offset'])
+
+    last_submit = {}
+    for job in jobs:
+        last_submit[job['cycle']] = max(job['submit_num'], last_submit.get(job['cycle'], 0))
+
+    new_state = None
+    offset = os.path.getsize(out_file)
+    with open(out_file, 'a') as out:
+        for i, job in enumerate(jobs):
+            if new_state is None and not finished(job, last_submit):
+                new_state = {'rowid': job['rowid'], 'count': state['count'] + i,
+                             'offset': offset, 'last': state['last']}
+            rep = '{:02d}'.format(job['submit_num'])
+            data_size = job_data_size(log_dir, task, job['cycle'], rep)
+            line = job_data_row(task, job['cycle'], rep, job_status(job), data_size)
+            out.write(line)
+            offset += len(line.encode())
+            if new_state is None:
+                state['last'] = [job['rowid'], job['cycle'], job['submit_num']]
+    if new_state is None:
+        rowid = jobs[-1]['rowid'] + 1 if jobs else state['rowid']
+        new_state = {'rowid': rowid, 'count': state['count'] + len(jobs), 'offset': offset,
+                     'last': state['last']}
+
+    with open(state_file + '.tmp', 'w') as f:
+        json.dump(new_state, f)
+    os.replace(state_file + '.tmp', state_file)
+    return len(jobs)
+
+
+async def extract_all(jobs, nprocs):
+    """Run extract jobs, (function, args) pairs, concurrently on a pool of
+    nprocs threads. Returns list of results or exceptions, in order."""
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=nprocs) as pool:
+        futures = [loop.run_in_executor(pool, function, *args) for function, args in jobs]
+        return await asyncio.gather(*futures, return_exceptions=True)
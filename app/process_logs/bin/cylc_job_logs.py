@@ -0,0 +1,336 @@
+"""Code for extracting job data from archived cylc job log directories.
+
+Walks log.*/job/<cycle>/<task>/<rep> directories and writes one CSV row
+per job, with the same columns as get_cylc_times.
+"""
+
+import json
+import os
+import re
+import sys
+import job_schema
+
+# All fields of interest in a [jobs-poll out] line of job-activity.log
+ACTIVITY_PATTERN = re.compile(
+    r'"(batch_sys_job_id|time_submit_exit|time_run|time_run_exit|run_signal)": "([^"]*)"'
+    r'|"(run_status)": ([^,]*),')
+
+# Data size reported in pptransfer job.out
+DATA_SIZE_PATTERN = re.compile(r'Total (.*?) Gb of data to transfer')
+
+# job.status variables written to CSV, in column order
+STATUS_KEYS = ['CYLC_BATCH_SYS_JOB_ID', 'CYLC_BATCH_SYS_JOB_SUBMIT_TIME',
+               'CYLC_JOB_INIT_TIME', 'CYLC_JOB_EXIT_TIME', 'CYLC_JOB_EXIT']
+
+# Map job-activity.log fields to job.status variables
+ACTIVITY_KEYS = {'batch_sys_job_id': 'CYLC_BATCH_SYS_JOB_ID',
+                 'time_submit_exit': 'CYLC_BATCH_SYS_JOB_SUBMIT_TIME',
+                 'time_run': 'CYLC_JOB_INIT_TIME',
+                 'time_run_exit': 'CYLC_JOB_EXIT_TIME'}
+
+# Files read from each job directory, recorded in the scan index
+JOB_FILES = ['job.status', 'job-activity.log', 'job.out']
+
+# Size of output buffer when writing job data
+BUFFER_SIZE = 1 << 20
+
+
+def read_job_status(status_file):
+    """Read job.status file into a dict of variables."""
+    status = {}
+    with open(status_file) as f:
+        for line in f:
+            key, sep, value = line.strip().partition('=')
+            if sep:
+                status[key] = value
+    return status
+
+
+def read_job_activity(activity_file):
+    """Get job status variables from last [jobs-poll out] line of job-activity.log."""
+    line = ''
+    with open(activity_file, errors='replace') as f:
+        for entry in f:
+            if '[jobs-poll out]' in entry:
+                line = entry
+
+    fields = {}
+    for match in ACTIVITY_PATTERN.finditer(line):
+        if match.group(1) is not None:
+            fields.setdefault(match.group(1), match.group(2))
+        else:
+            fields.setdefault(match.group(3), match.group(4))
+
+    status = {ACTIVITY_KEYS[key]: fields.get(key, '') for key in ACTIVITY_KEYS}
+    if fields.get('run_status') == '0':
+        status['CYLC_JOB_EXIT'] = 'SUCCEEDED'
+    else:
+        status['CYLC_JOB_EXIT'] = fields.get('run_signal', '')
+    return status
+
+
+def read_data_size(job_out):
+    """Get data size from pptransfer job.out, or empty string if not reported."""
+    with open(job_out, errors='replace') as f:
+        for line in f:
+            match = DATA_SIZE_PATTERN.search(line)
+            if match:
+                return match.group(1)
+    return ''
+
+
+def data_header(task):
+    """Header line for cylc job data CSV file."""
+    header = ['Cycle', 'Rep', 'Batch id',
+              'Submit time', 'Init time', 'Exit time', 'Exit status']
+    if task == 'pptransfer':
+        header.append('Data size (GB)')
+    return ','.join(header) + '\n'
+
+
+def job_data_row(task, cycle, rep, status, data_size=''):
+    """CSV line for a single cylc job."""
+    row = [cycle, rep] + [status.get(key, '') for key in STATUS_KEYS]
+    if task == 'pptransfer':
+        row.append(data_size)
+    return ','.join(row) + '\n'
+
+
+def read_job(job_dir, task):
+    """Get status variables and data size for a job directory.
+    Try job.status, then job-activity.log. Returns None if neither exists."""
+    data_size = ''
+    if task == 'pptransfer':
+        job_out = os.path.join(job_dir, 'job.out')
+        if os.path.isfile(job_out):
+            data_size = read_data_size(job_out)
+
+    status_file = os.path.join(job_dir, 'job.status')
+    activity_file = os.path.join(job_dir, 'job-activity.log')
+    if os.path.isfile(status_file):
+        return read_job_status(status_file), data_size
+    elif os.path.isfile(activity_file):
+        return read_job_activity(activity_file), data_size
+    else:
+        return None
+
+
+def list_dirs(path):
+    """Sorted names of entries in path."""
+    with os.scandir(path) as entries:
+        return sorted(entry.name for entry in entries)
+
+
+def iter_job_dirs(log_dir, task):
+    """Yield (log, cycle, rep, job dir) for every job of task under log_dir,
+    looking in all log.* directories."""
+    for log in list_dirs(log_dir):
+        if not log.startswith('log.'):
+            continue
+        job_root = os.path.join(log_dir, log, 'job')
+        if not os.path.isdir(job_root):
+            print('Warning: {} does not exist'.format(job_root), file=sys.stderr)
+            continue
+
+        for cycle in list_dirs(job_root):
+            task_dir = os.path.join(job_root, cycle, task)
+            if not os.path.isdir(task_dir):
+                continue
+
+            # Look at all repeats including failures, ignoring NN
+            for rep in list_dirs(task_dir):
+                if rep[:1].isdigit():
+                    yield log, cycle, rep, os.path.join(task_dir, rep)
+
+
+def scan_job_files(job_dir):
+    """Get [mtime, size] of the log files read from a job directory."""
+    files = {}
+    with os.scandir(job_dir) as entries:
+        for entry in entries:
+            if entry.name in JOB_FILES:
+                stat = entry.stat()
+                files[entry.name] = [stat.st_mtime_ns, stat.st_size]
+    return files
+
+
+def index_path(out_file):
+    """Scan index file kept alongside a job data CSV file."""
+    return os.path.splitext(out_file)[0] + '_index.jsonl'
+
+
+def read_index(index_file):
+    """Read scan index into a dict keyed by (log, cycle, task, rep).
+    Later entries replace earlier ones."""
+    index = {}
+    if os.path.isfile(index_file):
+        with open(index_file) as f:
+            for line in f:
+                entry = json.loads(line)
+                key = (entry['log'], entry['cycle'], entry['task'], entry['rep'])
+                index[key] = entry
+    return index
+
+
+def write_entries(f, entries):
+    """Write scan index entries as JSON lines."""
+    for entry in entries:
+        f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+
+
+def write_rows(f, entries):
+    """Write job data CSV rows held in scan index entries."""
+    for entry in entries:
+        if entry['row'] is not None:
+            f.write(entry['row'])
+
+
+def job_entry(job_dir, log, cycle, task, rep, files):
+    """Scan index entry for a job directory, holding its CSV row, or None
+    if there is no job information."""
+    row = None
+    job = read_job(job_dir, task)
+    if job is None:
+        print('Warning: {}: No job information'.format(job_dir), file=sys.stderr)
+    else:
+        status, data_size = job
+        row = job_data_row(task, cycle, rep, status, data_size)
+    return {'log': log, 'cycle': cycle, 'task': task, 'rep': rep,
+            'files': files, 'row': row}
+
+
+def job_finished(entry):
+    """Whether a scan index entry is for a job that has exited."""
+    return entry['row'] is not None and entry['row'].rstrip('\n').split(',')[6] != ''
+
+
+def write_job_data(out_file, task, old_index, index, new_keys, changed):
+    """Write job data and scan index for jobs in index. New rows are
+    appended if they sort after all existing rows, otherwise the file is
+    rewritten in (log, cycle, rep) order."""
+    index_file = index_path(out_file)
+
+    # Rewrite if jobs changed or were removed, or new jobs fall before old ones
+    removed = len(index) - len(new_keys) < len(old_index)
+    last_key = max(old_index) if old_index else None
+    interleaved = bool(new_keys) and last_key is not None and min(new_keys) < last_key
+    if not old_index or changed or removed or interleaved:
+        entries = [index[key] for key in sorted(index)]
+        with open(out_file, 'w', buffering=BUFFER_SIZE) as out:
+            out.write(data_header(task))
+            write_rows(out, entries)
+        with open(index_file, 'w', buffering=BUFFER_SIZE) as f:
+            write_entries(f, entries)
+        return
+
+    entries = [index[key] for key in sorted(new_keys)]
+    with open(out_file, 'a', buffering=BUFFER_SIZE) as out:
+        write_rows(out, entries)
+    with open(index_file, 'a', buffering=BUFFER_SIZE) as f:
+        write_entries(f, entries)
+
+
+def extract_job_data(log_dir, task, out_file, incremental=False, counts=None):
+    """Write batch id, submit time, start time, end time, exit status, and
+    data size for pptransfer, for all jobs of task in log_dir to out_file.
+
+    A scan index records the mtime and size of the files read for each job.
+    For incremental processing only new or changed job directories are
+    parsed. New rows are appended if they sort after all existing rows,
+    otherwise the file is rewritten in (log, cycle, rep) order.
+    If counts is given, the number of files scanned and bytes of files
+    parsed are added to counts['files'] and counts['bytes'].
+    Returns number of jobs parsed or removed, so 0 means out_file has the
+    same rows as before."""
+    index_file = index_path(out_file)
+    if incremental and os.path.isfile(out_file):
+        old_index = read_index(index_file)
+    else:
+        old_index = {}
+
+    index = {}
+    new_keys = []
+    parsed = 0
+    changed = False
+    for log, cycle, rep, job_dir in iter_job_dirs(log_dir, task):
+        key = (log, cycle, task, rep)
+        files = scan_job_files(job_dir)
+        entry = old_index.get(key)
+        if counts is not None:
+            counts['files'] = counts.get('files', 0) + len(files)
+        if entry is not None and entry['files'] == files:
+            index[key] = entry
+            continue
+
+        parsed += 1
+        if counts is not None:
+            counts['bytes'] = counts.get('bytes', 0) + sum(size for _, size in files.values())
+        index[key] = job_entry(job_dir, log, cycle, task, rep, files)
+        if entry is None:
+            new_keys.append(key)
+        else:
+            changed = True
+
+    write_job_data(out_file, task, old_index, index, new_keys, changed)
+    removed = len(old_index) - (len(index) - len(new_keys))
+    return parsed + removed
+
+
+def update_job_data(task, out_file, jobs, counts=None):
+    """Update job data in out_file for just the job directories given, as
+    (log, cycle, rep, job dir), e.g. those seen to change by watch_logs.
+    Other jobs are kept from the scan index, which extract_job_data must
+    have written first. Job directories that have gone are skipped.
+    Returns scan index entries of the jobs given."""
+    old_index = read_index(index_path(out_file))
+    index = dict(old_index)
+    new_keys = []
+    changed = False
+    entries = []
+    for log, cycle, rep, job_dir in jobs:
+        key = (log, cycle, task, rep)
+        try:
+            files = scan_job_files(job_dir)
+        except FileNotFoundError:
+            continue
+        entry = old_index.get(key)
+        if counts is not None:
+            counts['files'] = counts.get('files', 0) + len(files)
+        if entry is not None and entry['files'] == files:
+            entries.append(entry)
+            continue
+
+        if counts is not None:
+            counts['bytes'] = counts.get('bytes', 0) + sum(size for _, size in files.values())
+        index[key] = job_entry(job_dir, log, cycle, task, rep, files)
+        entries.append(index[key])
+        if entry is None:
+            new_keys.append(key)
+        else:
+            changed = True
+
+    write_job_data(out_file, task, old_index, index, new_keys, changed)
+    return entries
+
+
+def process_job_data(raw_file, proc_file):
+    """Calculate run time and queue time for each job, and remove entries
+    with no batch id."""
+    # Read data
+    logs = job_schema.read_csv(raw_file)
+
+    # Check there is data in the file
+    if len(logs.index) > 0:
+
+        # Drop null batch ids
+        logs = logs[logs.index.notnull()]
+
+        # Derive queue time and run time
+        logs['Queued time (s)'] = ( logs['Init time']-logs['Submit time'] ).dt.total_seconds()
+        logs['Elapsed time (s)'] = ( logs['Exit time']-logs['Init time'] ).dt.total_seconds()
+        logs = job_schema.apply_schema(logs)
+
+    # Write data, replacing any old file at once so readers never see part of it
+    tmp_file = proc_file + '.tmp'
+    logs.to_csv(tmp_file)
+    os.replace(tmp_file, proc_file)
@@ -0,0 +1,233 @@
+"""Code for transferring log files to an archive, skipping files that have
+already been sent.
+
+A destination is either a local directory or host:directory. Commands at
+the destination are run with ssh, or locally for a local directory, so
+transfers can be tested against a local directory standing in for the
+remote host.
+
+A manifest records the size and mtime of each file transferred. Only new or
+changed files are sent, and each is checked on arrival by comparing its size,
+or optionally its SHA1 checksum. Files that fail are retried, and are not
+added to the manifest until they arrive intact.
+
+Files are copied with COPY_CMD. If this is rsync, the list of files to send
+is passed with --files-from. If it is tar, the files are sent as a single
+tar stream and unpacked at the destination. Either way, the list is passed
+in a temporary file.
+"""
+
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REMOTE_SHELL = 'ssh'
+
+# Arguments to a command run at the destination are passed null separated
+# on stdin, so are safe from word splitting
+STAT_CMD = "xargs -0 -r stat -c '%s %n' --"
+CHECKSUM_CMD = 'xargs -0 -r sha1sum --'
+
+
+def split_dest(dest):
+    """Split destination into (host, path). Host is None for a local path."""
+    host, sep, path = dest.partition(':')
+    if sep and '/' not in host:
+        return host, path
+    return None, dest
+
+
+def command_at(host, cmd):
+    """Arguments to run a shell command at host, or locally if host is None."""
+    if host is None:
+        return ['bash', '-c', cmd]
+    return [REMOTE_SHELL, '-o', 'BatchMode=yes', host, cmd]
+
+
+def run_at(host, cmd, input=None):
+    """Run a shell command at host, or locally if host is None."""
+    return subprocess.run(command_at(host, cmd), input=input,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def scan_files(src_dir):
+    """Files under src_dir, as {relative path: [size, mtime_ns]}.
+    Symbolic links are recorded by their target."""
+    files = {}
+    stack = ['']
+    while stack:
+        rel_dir = stack.pop()
+        with os.scandir(os.path.join(src_dir, rel_dir)) as entries:
+            for entry in entries:
+                rel = os.path.join(rel_dir, entry.name)
+                if entry.is_symlink():
+                    files[rel] = os.readlink(entry.path)
+                elif entry.is_dir():
+                    stack.append(rel)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    files[rel] = [stat.st_size, stat.st_mtime_ns]
+    return files
+
+
+def stat_files(src_dir, rel_paths):
+    """Files in rel_paths under src_dir, as for scan_files. Missing files
+    are left out."""
+    files = {}
+    for rel in rel_paths:
+        path = os.path.join(src_dir, rel)
+        if os.path.islink(path):
+            files[rel] = os.readlink(path)
+        elif os.path.isfile(path):
+            stat = os.stat(path)
+            files[rel] = [stat.st_size, stat.st_mtime_ns]
+    return files
+
+
+def read_manifest(manifest_file):
+    """Read manifest of files already transferred."""
+    if manifest_file is not None and os.path.isfile(manifest_file):
+        with open(manifest_file) as f:
+            return json.load(f)
+    return {}
+
+
+def write_manifest(manifest_file, manifest):
+    """Write manifest of files transferred."""
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_file)), exist_ok=True)
+    tmp_file = manifest_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_file, manifest_file)
+
+
+def changed_files(files, manifest):
+    """Files that are new or changed since they were last transferred."""
+    return sorted(rel for rel, info in files.items() if manifest.get(rel) != info)
+
+
+def copy_files(copy_cmd, src_dir, rel_paths, dest):
+    """Copy files from src_dir to dest, keeping their relative paths.
+    Returns error message, or None if the copy succeeded."""
+    host, path = split_dest(dest)
+    cmd = shlex.split(copy_cmd)
+    # Pass the file list in a file, so tar can't block writing its archive
+    # while the list is still being written to it
+    with tempfile.NamedTemporaryFile() as f:
+        f.write('\0'.join(rel_paths).encode())
+        f.flush()
+        if cmd[0] == 'tar':
+            pack = subprocess.Popen(['tar', '-C', src_dir, '--null', '-T', f.name, '-cf', '-'],
+                                    stdout=subprocess.PIPE)
+            unpack_cmd = 'mkdir -p {0} && tar -C {0} -xf -'.format(shlex.quote(path))
+            unpack = subprocess.run(command_at(host, unpack_cmd), stdin=pack.stdout,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            pack.stdout.close()
+            if pack.wait() != 0:
+                return 'tar failed with exit code {}'.format(pack.returncode)
+            result = unpack
+        else:
+            result = subprocess.run(cmd + ['--from0', '--files-from='+f.name,
+                                           src_dir.rstrip('/')+'/', dest.rstrip('/')+'/'],
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        return '{} failed with exit code {}: {}'.format(
+            cmd[0], result.returncode, result.stderr.decode(errors='replace').strip())
+    return None
+
+
+def file_digest(path):
+    """SHA1 checksum of a file."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def dest_values(dest, rel_paths, checksum=False):
+    """Sizes, or checksums, of files at dest, as {relative path: value}.
+    Missing files are left out."""
+    host, path = split_dest(dest)
+    cmd = 'cd {} && {}'.format(shlex.quote(path), CHECKSUM_CMD if checksum else STAT_CMD)
+    result = run_at(host, cmd, '\0'.join(rel_paths).encode())
+    values = {}
+    for line in result.stdout.decode(errors='replace').splitlines():
+        if checksum:
+            value, _, rel = line.partition('  ')
+        else:
+            value, _, rel = line.partition(' ')
+            value = int(value)
+        values[rel] = value
+    return values
+
+
+def verify_files(src_dir, rel_paths, dest, files, checksum=False):
+    """Check files arrived intact. Returns list of files that didn't.
+    Only regular files are checked."""
+    rel_paths = [rel for rel in rel_paths if isinstance(files[rel], list)]
+    values = dest_values(dest, rel_paths, checksum)
+    bad = []
+    for rel in rel_paths:
+        if checksum:
+            expected = file_digest(os.path.join(src_dir, rel))
+        else:
+            expected = files[rel][0]
+        if values.get(rel) != expected:
+            bad.append(rel)
+    return bad
+
+
+def transfer_files(src_dir, dest, rel_paths=None, manifest_file=None, copy_cmd='rsync -ar',
+                   checksum=False, retries=2, retry_delay=30):
+    """Transfer new or changed files from src_dir to dest, optionally only
+    those in rel_paths. Files listed in the manifest with the same size and
+    mtime are skipped.
+    Returns (number of files sent, list of files that failed, error message or None)."""
+    if rel_paths is None:
+        files = scan_files(src_dir)
+    else:
+        files = stat_files(src_dir, rel_paths)
+    manifest = read_manifest(manifest_file)
+    todo = changed_files(files, manifest)
+    if not todo:
+        return 0, [], None
+
+    sent = 0
+    error = None
+    for attempt in range(retries+1):
+        if attempt > 0:
+            time.sleep(retry_delay)
+        error = copy_files(copy_cmd, src_dir, todo, dest)
+        if error is not None:
+            continue
+        bad = set(verify_files(src_dir, todo, dest, files, checksum))
+        for rel in todo:
+            if rel not in bad:
+                manifest[rel] = files[rel]
+                sent += 1
+        if manifest_file is not None:
+            write_manifest(manifest_file, manifest)
+        todo = sorted(bad)
+        if not todo:
+            break
+        error = '{} files failed verification'.format(len(todo))
+    return sent, todo, error
+
+
+def transfer_all(jobs, nprocs):
+    """Run transfers concurrently, at most nprocs at a time. Jobs are
+    (name, transfer function, args) tuples.
+    Yields (name, result or exception) in job order."""
+    with ThreadPoolExecutor(max_workers=nprocs) as pool:
+        futures = [(name, pool.submit(func, *args)) for name, func, args in jobs]
+        for name, future in futures:
+            try:
+                yield name, future.result()
+            except Exception as err:
+                yield name, err
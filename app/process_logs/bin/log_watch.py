@@ -0,0 +1,277 @@
+"""Code for watching archived job log directories for new or changed jobs.
+
+Jobs are found in <archive>/<suite>/log.*/job/<cycle>/<task>/<rep>.
+JobTree keeps the mtime and entries of each directory above the job
+directories, and the files of jobs that haven't finished (open jobs). A
+scan lists only directories whose mtime has changed, and checks the files
+of open jobs, so new jobs are found without listing every job directory or
+reading any job files.
+
+With inotify (Linux, through ctypes) the same directories, and the
+directories of open jobs, are watched instead, and only directories with
+events are scanned. inotify doesn't see changes made on other hosts of a
+network file system, so a full scan is still done now and then.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from cylc_job_logs import JOB_FILES, list_dirs, scan_job_files
+
+# inotify event masks, from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+# Depth of each directory below the archive, as path parts
+SUITE, LOG, JOB_ROOT, CYCLE, TASK, JOB = range(1, 7)
+
+
+class Inotify:
+    """Minimal inotify interface, using libc through ctypes."""
+
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, 'inotify_init1: ' + os.strerror(errno))
+        self.paths = {}
+        self.wds = {}
+
+    def add_watch(self, path):
+        """Watch a directory for files written and entries created."""
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, 'inotify_add_watch: ' + os.strerror(errno), path)
+        self.paths[wd] = path
+        self.wds[path] = wd
+
+    def rm_watch(self, path):
+        """Stop watching a directory."""
+        wd = self.wds.pop(path, None)
+        if wd is not None:
+            self.paths.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout):
+        """Wait up to timeout seconds for events.
+        Returns list of (directory, name, mask)."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+
+        events = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, pos)
+            name = data[pos+self.EVENT.size:pos+self.EVENT.size+length].rstrip(b'\0')
+            pos += self.EVENT.size + length
+            if mask & IN_IGNORED:
+                # Watch removed, e.g. directory deleted
+                path = self.paths.pop(wd, None)
+                if path is not None:
+                    self.wds.pop(path, None)
+                continue
+            events.append((self.paths.get(wd), os.fsdecode(name), mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class JobTree:
+    """Directories of archived job logs, for finding new or changed jobs."""
+
+    def __init__(self, archive_dir, suites, tasks, state=None, watcher=None):
+        """state is from a previous JobTree, see state(). watcher is an
+        Inotify to add watches for directories to, if given."""
+        self.archive_dir = archive_dir
+        self.suites = list(suites)
+        self.tasks = list(tasks)
+        self.dirs = {}
+        self.open = {}
+        if state is not None:
+            self.dirs = state['dirs']
+            self.open = state['open']
+        self.watcher = watcher
+
+    def state(self):
+        """State to save, to carry on from after a restart."""
+        return {'dirs': self.dirs, 'open': self.open}
+
+    def path(self, rel):
+        return os.path.join(self.archive_dir, rel)
+
+    def wanted(self, depth, name):
+        """Whether a directory entry at a depth is part of the tree."""
+        if depth == LOG:
+            return name.startswith('log.')
+        elif depth == JOB_ROOT:
+            return name == 'job'
+        elif depth == TASK:
+            return name in self.tasks
+        elif depth == JOB:
+            # All repeats including failures, ignoring NN
+            return name[:1].isdigit()
+        return True
+
+    def watch(self, rel):
+        """Add a watch for a directory, if watching. If a watch can't be
+        added, e.g. over the limit of watches, stop watching, so the tree
+        has to be polled."""
+        if self.watcher is not None:
+            try:
+                self.watcher.add_watch(self.path(rel))
+            except OSError as err:
+                print("Warning: {}".format(err), file=sys.stderr)
+                self.watcher = None
+
+    def watch_all(self):
+        """Add watches for all directories in the tree and open jobs."""
+        for rel in list(self.dirs) + list(self.open):
+            self.watch(rel)
+
+    def forget(self, rel):
+        """Remove a directory that has gone, and everything under it."""
+        prefix = rel + '/'
+        for tree in (self.dirs, self.open):
+            for key in [key for key in tree if key == rel or key.startswith(prefix)]:
+                del tree[key]
+                if self.watcher is not None:
+                    self.watcher.rm_watch(self.path(key))
+
+    def set_open(self, rel, files):
+        """Record the files of a job that hasn't finished, to check again."""
+        if rel not in self.open:
+            self.watch(rel)
+        self.open[rel] = files
+
+    def close(self, rel):
+        """Stop checking a job that has finished."""
+        if self.open.pop(rel, None) is not None and self.watcher is not None:
+            self.watcher.rm_watch(self.path(rel))
+
+    def scan(self, rel=None):
+        """Scan the tree, or the part of it under rel, for new jobs and open
+        jobs with changed files. Returns set of job dirs, relative to the
+        archive dir."""
+        found = set()
+        if rel is None:
+            for suite in self.suites:
+                self._scan(suite, SUITE, found)
+        else:
+            self._scan(rel, rel.count('/') + 1, found)
+        return found
+
+    def _scan(self, rel, depth, found):
+        path = self.path(rel)
+        if depth == JOB:
+            try:
+                files = scan_job_files(path)
+            except FileNotFoundError:
+                self.forget(rel)
+                return
+            if files != self.open.get(rel):
+                found.add(rel)
+            return
+
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            self.forget(rel)
+            return
+        entry = self.dirs.get(rel)
+        if entry is None or entry[0] != mtime:
+            if entry is None:
+                self.watch(rel)
+            names = [name for name in list_dirs(path) if self.wanted(depth+1, name)]
+            old = set(entry[1]) if entry is not None else set()
+            for name in old.difference(names):
+                self.forget(rel + '/' + name)
+            self.dirs[rel] = [mtime, names]
+            new = set(names).difference(old)
+        else:
+            names = entry[1]
+            new = set()
+
+        for name in names:
+            child = rel + '/' + name
+            if depth + 1 < JOB:
+                self._scan(child, depth+1, found)
+            elif name in new:
+                found.add(child)
+            elif child in self.open:
+                self._scan(child, JOB, found)
+
+    def event(self, path, name, mask):
+        """Handle an inotify event. Returns set of job dirs found."""
+        if mask & IN_Q_OVERFLOW or path is None:
+            # Events lost, so check everything
+            return self.scan()
+        rel = os.path.relpath(path, self.archive_dir)
+        depth = rel.count('/') + 1
+        if depth == JOB:
+            if name in JOB_FILES:
+                return {rel}
+            return set()
+        return self.scan(rel)
+
+
+def job_parts(rel):
+    """(suite, log, cycle, task, rep) of a job dir relative to the archive."""
+    suite, log, _, cycle, task, rep = rel.split('/')
+    return suite, log, cycle, task, rep
+
+
+class Debouncer:
+    """Hold keys until they have been quiet for a while."""
+
+    def __init__(self, delay, pending=()):
+        self.delay = delay
+        self.pending = dict.fromkeys(pending, 0.0)
+
+    def add(self, keys, now=None):
+        now = time.time() if now is None else now
+        for key in keys:
+            self.pending[key] = now
+
+    def ready(self, now=None):
+        """Remove and return keys not added again for delay seconds."""
+        now = time.time() if now is None else now
+        keys = [key for key, added in self.pending.items() if now - added >= self.delay]
+        for key in keys:
+            del self.pending[key]
+        return keys
+
+
+class Backoff:
+    """Poll interval, doubled each time nothing is found up to a maximum,
+    and reset when something is."""
+
+    def __init__(self, minimum, maximum):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.interval = minimum
+
+    def update(self, found):
+        if found:
+            self.interval = self.minimum
+        else:
+            self.interval = min(self.interval * 2, self.maximum)
+        return self.interval
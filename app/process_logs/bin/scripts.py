@@ -0,0 +1,16 @@
+"""Import the scripts in this directory, which have no .py extension, as
+modules, e.g. to test or benchmark their functions."""
+
+import importlib.util
+import os
+from importlib.machinery import SourceFileLoader
+
+BIN_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_script(name):
+    """Import a script from this directory as a module."""
+    loader = SourceFileLoader(name, os.path.join(BIN_DIR, name))
+    module = importlib.util.module_from_spec(importlib.util.spec_from_loader(name, loader))
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+# Generate a synthetic archive of cylc job logs for benchmarking.
+# Writes <out dir>/logs/<suite>/log.*/job/<cycle>/<task>/<rep> trees
+# and a matching <out dir>/suite_status.csv. Optionally also writes a cylc 8
+# workflow database (log.*/db) with the same jobs, in the latest log dir.
+
+import argparse
+import os
+import random
+import sqlite3
+from datetime import datetime, timedelta
+
+SUITE_STATUS_HEADER = ('Suite id,User,Description,Production,Status,Retrieve logs,'
+                       'Process logs,Cycle length (days),Run length (cycles),First cycle,'
+                       'Final cycle,Start time,File system,First NVMe cycle,XIOS logs,'
+                       'First no log cycle')
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# task_jobs table of a cylc 8 workflow database
+TASK_JOBS_TABLE = ('CREATE TABLE task_jobs(cycle TEXT, name TEXT, submit_num INTEGER, '
+                   'flow_nums TEXT, is_manual_submit INTEGER, try_num INTEGER, '
+                   'time_submit TEXT, time_submit_exit TEXT, submit_status INTEGER, '
+                   'time_run TEXT, time_run_exit TEXT, run_signal TEXT, run_status INTEGER, '
+                   'platform_name TEXT, job_runner_name TEXT, job_id TEXT, '
+                   'PRIMARY KEY(cycle, name, submit_num))')
+
+
+def cycle_point(start_year, cycle_len, i):
+    """Cycle point of the ith cycle in a 360 day calendar."""
+    days = i * cycle_len
+    year = start_year + days // 360
+    month = (days % 360) // 30 + 1
+    day = days % 30 + 1
+    return '{:04d}{:02d}{:02d}T0000Z'.format(year, month, day)
+
+
+def write_job_status(job_dir, batch_id, submit, init, exit_time, status):
+    """Write job.status file."""
+    with open(os.path.join(job_dir, 'job.status'), 'w') as f:
+        f.write('CYLC_JOB_RUNNER_NAME=slurm\n')
+        f.write('CYLC_BATCH_SYS_JOB_ID={}\n'.format(batch_id))
+        f.write('CYLC_BATCH_SYS_JOB_SUBMIT_TIME={}\n'.format(submit.strftime(TIME_FORMAT)))
+        f.write('CYLC_JOB_PID=12345\n')
+        f.write('CYLC_JOB_INIT_TIME={}\n'.format(init.strftime(TIME_FORMAT)))
+        f.write('CYLC_JOB_EXIT={}\n'.format(status))
+        f.write('CYLC_JOB_EXIT_TIME={}\n'.format(exit_time.strftime(TIME_FORMAT)))
+
+
+def write_job_activity(job_dir, point, task, rep, batch_id, submit, init, exit_time, status):
+    """Write job-activity.log file, as left when job.status is missing."""
+    run_status = 0 if status == 'SUCCEEDED' else 1
+    with open(os.path.join(job_dir, 'job-activity.log'), 'w') as f:
+        f.write('[jobs-submit ret_code] 0\n')
+        f.write('[jobs-submit out] {}|{}/{}/{}|0|{}\n'.format(
+            submit.strftime(TIME_FORMAT), point, task, rep, batch_id))
+        f.write('[jobs-poll out] {}|{}/{}/{}|{{"batch_sys_name": "slurm", '
+                '"batch_sys_job_id": "{}", "batch_sys_exit_polled": 0, '
+                '"run_signal": "EXIT", "run_status": {}, '
+                '"time_submit_exit": "{}", "time_run": "{}", "time_run_exit": "{}"}}\n'.format(
+                    exit_time.strftime(TIME_FORMAT), point, task, rep, batch_id, run_status,
+                    submit.strftime(TIME_FORMAT), init.strftime(TIME_FORMAT),
+                    exit_time.strftime(TIME_FORMAT)))
+
+
+def write_job_out(job_dir, data_size):
+    """Write pptransfer job.out file reporting data size."""
+    with open(os.path.join(job_dir, 'job.out'), 'w') as f:
+        f.write('Suite    : synthetic\nTask Job : pptransfer\n')
+        f.write('Total {:.2f} Gb of data to transfer\n'.format(data_size))
+        f.write('Transfer complete\n')
+
+
+def write_db(db_file, jobs):
+    """Write cylc 8 workflow database with task_jobs rows for jobs."""
+    conn = sqlite3.connect(db_file)
+    with conn:
+        conn.execute(TASK_JOBS_TABLE)
+        conn.executemany('INSERT INTO task_jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         jobs)
+    conn.close()
+
+
+def make_suite(log_root, n_cycles, cycle_len, n_logs, max_reps,
+               fail_frac, activity_frac, missing_frac, start, rng, db=False):
+    """Write job logs for a single suite, and its database if db is set.
+    Returns last cycle point written."""
+    now = start
+    batch_id = rng.randint(1000000, 8000000)
+    logs = ['log.{}'.format((start + timedelta(days=30*i)).strftime('%Y%m%dT%H%M%SZ'))
+            for i in range(n_logs)]
+    last_point = None
+    jobs = []
+    for i in range(n_cycles):
+        point = cycle_point(1850, cycle_len, i)
+        last_point = point
+        if rng.random() < missing_frac:
+            continue
+        log = logs[min(i * n_logs // n_cycles, n_logs-1)]
+
+        for task, runtime in (('coupled', 3.0), ('pptransfer', 0.3)):
+            for rep in range(1, max_reps+1):
+                failed = rep < max_reps and rng.random() < fail_frac
+                status = 'EXIT' if failed else 'SUCCEEDED'
+                submit = now
+                init = submit + timedelta(hours=rng.uniform(0, 10))
+                hours = runtime * rng.uniform(0.8, 1.2) * (rng.uniform(0.1, 0.9) if failed else 1)
+                exit_time = init + timedelta(hours=hours)
+                now = exit_time
+                batch_id += 1
+
+                rep_name = '{:02d}'.format(rep)
+                job_dir = os.path.join(log_root, log, 'job', point, task, rep_name)
+                os.makedirs(job_dir)
+                if rng.random() < activity_frac:
+                    write_job_activity(job_dir, point, task, rep_name, batch_id,
+                                       submit, init, exit_time, status)
+                else:
+                    write_job_status(job_dir, batch_id, submit, init, exit_time, status)
+                if task == 'pptransfer':
+                    write_job_out(job_dir, rng.uniform(100, 400))
+                jobs.append((point, task, rep, '[1]', 0, rep,
+                             submit.strftime(TIME_FORMAT), submit.strftime(TIME_FORMAT), 0,
+                             init.strftime(TIME_FORMAT), exit_time.strftime(TIME_FORMAT),
+                             'EXIT' if failed else None, 1 if failed else 0,
+                             'archer2', 'slurm', str(batch_id)))
+                if not failed:
+                    break
+    if db:
+        write_db(os.path.join(log_root, logs[-1], 'db'), jobs)
+    return last_point
+
+
+def make_tree(out_dir, n_suites=4, n_cycles=100, cycle_len=90, n_logs=2, max_reps=2,
+              fail_frac=0.1, activity_frac=0.2, missing_frac=0.0, seed=1, db=False):
+    """Write synthetic log archive and suite status file under out_dir."""
+    rng = random.Random(seed)
+    archive_dir = os.path.join(out_dir, 'logs')
+    lines = [SUITE_STATUS_HEADER]
+    for n in range(n_suites):
+        suite = 'u-bm{:03d}'.format(n)
+        start = datetime(2023, 1, 1) + timedelta(days=7*n)
+        last_point = make_suite(os.path.join(archive_dir, suite), n_cycles, cycle_len,
+                                n_logs, max_reps, fail_frac, activity_frac, missing_frac,
+                                start, rng, db)
+        nvme = n % 2 == 1
+        lines.append(','.join([
+            suite, 'bench', 'Synthetic #{}'.format(n), 'True', 'Running', 'True', 'True',
+            str(cycle_len), str(n_cycles), cycle_point(1850, cycle_len, 0), last_point,
+            start.strftime(TIME_FORMAT), 'NVMe' if nvme else 'Work',
+            cycle_point(1850, cycle_len, n_cycles//2) if nvme else '', 'True', '']))
+
+    with open(os.path.join(out_dir, 'suite_status.csv'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return archive_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic cylc job log trees.')
+    parser.add_argument('out_dir', help='Output directory')
+    parser.add_argument('--suites', type=int, default=4, help='Number of suites')
+    parser.add_argument('--cycles', type=int, default=100, help='Number of cycles per suite')
+    parser.add_argument('--cycle-len', type=int, default=90, help='Cycle length (days)')
+    parser.add_argument('--logs', type=int, default=2, help='Number of log.* dirs per suite')
+    parser.add_argument('--reps', type=int, default=2, help='Maximum reps per task')
+    parser.add_argument('--fail', type=float, default=0.1, help='Fraction of jobs failing')
+    parser.add_argument('--activity', type=float, default=0.2,
+                        help='Fraction of jobs with job-activity.log instead of job.status')
+    parser.add_argument('--missing', type=float, default=0.0,
+                        help='Fraction of cycles missing from the archive')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    parser.add_argument('--db', action='store_true',
+                        help='Also write a workflow database for each suite')
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    make_tree(args.out_dir, args.suites, args.cycles, args.cycle_len, args.logs, args.reps,
+              args.fail, args.activity, args.missing, args.seed, args.db)
+
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+
+# Benchmark the log analysis pipeline on a synthetic log tree.
+# Each benchmark is run repeatedly, each time in a fresh process, recording
+# wall time, CPU time and peak memory. Results are written as JSON so
+# revisions can be compared:
+#   run_benchmarks.py results.json
+#   run_benchmarks.py --compare old.json new.json
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROCESS_BIN = os.path.join(REPO_DIR, 'app', 'process_logs', 'bin')
+ANALYSIS_BIN = os.path.join(REPO_DIR, 'app', 'analyse_data', 'bin')
+LIB_DIR = os.path.join(REPO_DIR, 'lib', 'python')
+for path in (os.path.dirname(os.path.abspath(__file__)), PROCESS_BIN, ANALYSIS_BIN, LIB_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+from scripts import load_script
+
+TASKS = ['coupled', 'pptransfer']
+
+
+def suites(work_dir):
+    """Suites in synthetic suite status file."""
+    with open(os.path.join(work_dir, 'suite_status.csv')) as f:
+        return [line.split(',', 1)[0] for line in f.readlines()[1:]]
+
+
+# Benchmarks. Each takes the work dir, which holds the synthetic tree and
+# the outputs of earlier pipeline stages, and writes to out_dir.
+
+def bench_extract(work_dir, out_dir):
+    """Extract and process job data for all suites and tasks."""
+    from cylc_job_logs import extract_job_data, process_job_data
+    for suite in suites(work_dir):
+        for task in TASKS:
+            raw_file = os.path.join(out_dir, '{}_{}_raw.csv'.format(suite, task))
+            proc_file = os.path.join(out_dir, '{}_{}_proc.csv'.format(suite, task))
+            extract_job_data(os.path.join(work_dir, 'logs', suite), task, raw_file)
+            process_job_data(raw_file, proc_file)
+
+
+def bench_extract_db(work_dir, out_dir):
+    """Extract and process job data for all suites and tasks from their
+    workflow databases."""
+    extract_db_jobs = load_script('extract_db_jobs')
+    extract_db_jobs.extract_db_jobs(suites(work_dir), TASKS, os.path.join(work_dir, 'logs'),
+                                    out_dir, None, None)
+
+
+def bench_check_logs(work_dir, out_dir):
+    """Check for gaps in archived cycles for all suites."""
+    env = dict(os.environ, ARCHIVE_DIR=os.path.join(work_dir, 'logs'), REPORT_DIR=out_dir,
+               REPORT_FILE='log_report.csv',
+               SUITE_STATUS=os.path.join(work_dir, 'suite_status.csv'))
+    result = subprocess.run([os.path.join(PROCESS_BIN, 'check_logs')], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    # Exits with the number of suites with missing cycles, anything else is a failure
+    missing = [f for f in os.listdir(out_dir) if f.endswith('_missing.txt')]
+    if result.returncode != len(missing):
+        raise RuntimeError('check_logs failed with exit code {}:\n{}'.format(
+            result.returncode, result.stderr))
+
+
+def bench_concat(work_dir, out_dir):
+    """Concatenate processed job data for all suites."""
+    concat_logs = load_script('concat_logs')
+    for task in TASKS:
+        concat_logs.concat_suite_logs(task, os.path.join(work_dir, 'suite_status.csv'),
+                                      os.path.join(work_dir, 'processed'),
+                                      os.path.join(out_dir, '{}_jobs.csv'.format(task)))
+
+
+def bench_derive(work_dir, out_dir):
+    """Load and derive coupled and pptransfer job data."""
+    from cylc_performance import SuiteStatus, CoupledData, PPTransferData
+    suite_status = SuiteStatus(os.path.join(work_dir, 'suite_status.csv'))
+    CoupledData.load_derived(os.path.join(work_dir, 'coupled_jobs.csv'), suite_status)
+    PPTransferData.load_derived(os.path.join(work_dir, 'pptransfer_jobs.csv'), suite_status)
+
+
+def bench_rollup(work_dir, out_dir):
+    """Build daily rollups of coupled and pptransfer job data from scratch."""
+    import rollup_jobs
+    rollup_jobs.generate_rollups(work_dir, os.path.join(out_dir, 'rollups'))
+
+
+def bench_plot(work_dir, out_dir):
+    """Draw all coupled plots, using a single process."""
+    import plot_coupled
+    cwd = os.getcwd()
+    os.chdir(out_dir)
+    try:
+        plot_coupled.generate_plots(data_dir=work_dir, plot_dir=out_dir, nprocs=1)
+    finally:
+        os.chdir(cwd)
+
+
+def bench_stats(work_dir, out_dir):
+    """Work out suite stats from scratch."""
+    import performance_stats
+    performance_stats.generate_stats(work_dir, os.path.join(out_dir, 'suite_perf.csv'),
+                                     os.path.join(out_dir, 'stats', 'coupled_state.json'))
+
+
+BENCHMARKS = {
+    'extract': bench_extract,
+    'extract_db': bench_extract_db,
+    'check_logs': bench_check_logs,
+    'concat': bench_concat,
+    'derive': bench_derive,
+    'rollup': bench_rollup,
+    'plot': bench_plot,
+    'stats': bench_stats,
+}
+
+
+def prepare(work_dir, tree_args):
+    """Generate synthetic tree and the inputs each benchmark needs."""
+    from make_log_tree import make_tree
+    from cylc_job_logs import extract_job_data, process_job_data
+    make_tree(work_dir, db=True, **tree_args)
+    concat_logs = load_script('concat_logs')
+    for suite in suites(work_dir):
+        proc_dir = os.path.join(work_dir, 'processed', suite)
+        os.makedirs(proc_dir)
+        for task in TASKS:
+            raw_file = os.path.join(work_dir, '{}_{}_raw.csv'.format(suite, task))
+            extract_job_data(os.path.join(work_dir, 'logs', suite), task, raw_file)
+            process_job_data(raw_file, os.path.join(proc_dir, '{}_cylc.csv'.format(task)))
+    for task in TASKS:
+        concat_logs.concat_suite_logs(task, os.path.join(work_dir, 'suite_status.csv'),
+                                      os.path.join(work_dir, 'processed'),
+                                      os.path.join(work_dir, '{}_jobs.csv'.format(task)))
+
+
+def run_once(name, work_dir):
+    """Run a benchmark in this process and return its measurements."""
+    out_dir = tempfile.mkdtemp(dir=work_dir)
+    try:
+        start_cpu = time.process_time()
+        start = time.perf_counter()
+        BENCHMARKS[name](work_dir, out_dir)
+        wall = time.perf_counter() - start
+        cpu = time.process_time() - start_cpu
+    finally:
+        shutil.rmtree(out_dir)
+    # Include any child processes, e.g. for shell scripts
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    child_cpu = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {'wall': wall, 'cpu': cpu + child_cpu.ru_utime + child_cpu.ru_stime,
+            'max_rss_kb': max(self_rss, child_rss)}
+
+
+def run_benchmark(name, work_dir, repeats):
+    """Run a benchmark repeatedly, each time in a fresh process."""
+    runs = []
+    for i in range(repeats):
+        result = subprocess.run([sys.executable, os.path.abspath(__file__),
+                                 '--single', name, '--work-dir', work_dir],
+                                check=True, capture_output=True, text=True)
+        runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    walls = [run['wall'] for run in runs]
+    return {'wall_min': min(walls), 'wall_median': statistics.median(walls),
+            'cpu_median': statistics.median(run['cpu'] for run in runs),
+            'max_rss_kb': max(run['max_rss_kb'] for run in runs),
+            'repeats': repeats}
+
+
+def git_revision():
+    """Current git revision of the repository, if available."""
+    try:
+        result = subprocess.run(['git', '-C', REPO_DIR, 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True, text=True)
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(old_file, new_file):
+    """Print ratio of new to old timings and memory."""
+    with open(old_file) as f:
+        old = json.load(f)
+    with open(new_file) as f:
+        new = json.load(f)
+    print('{:12s} {:>10s} {:>10s} {:>8s} {:>10s}'.format(
+        'Benchmark', old['revision'], new['revision'], 'Speedup', 'Mem ratio'))
+    for name in new['results']:
+        if name not in old['results']:
+            continue
+        o, n = old['results'][name], new['results'][name]
+        print('{:12s} {:10.3f} {:10.3f} {:8.2f} {:10.2f}'.format(
+            name, o['wall_median'], n['wall_median'], o['wall_median'] / n['wall_median'],
+            n['max_rss_kb'] / o['max_rss_kb']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark log analysis pipeline.')
+    parser.add_argument('out_file', nargs='?', default='bench_results.json',
+                        help='JSON file to write results to')
+    parser.add_argument('--benchmarks', nargs='+', choices=list(BENCHMARKS),
+                        default=list(BENCHMARKS), help='Benchmarks to run')
+    parser.add_argument('--repeats', type=int, default=3, help='Runs of each benchmark')
+    parser.add_argument('--suites', type=int, default=4, help='Number of suites')
+    parser.add_argument('--cycles', type=int, default=100, help='Number of cycles per suite')
+    parser.add_argument('--reps', type=int, default=2, help='Maximum reps per task')
+    parser.add_argument('--fail', type=float, default=0.1, help='Fraction of jobs failing')
+    parser.add_argument('--activity', type=float, default=0.2,
+                        help='Fraction of jobs with job-activity.log instead of job.status')
+    parser.add_argument('--missing', type=float, default=0.0,
+                        help='Fraction of cycles missing from the archive')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    parser.add_argument('--work-dir', help='Use existing work dir, and keep it')
+    parser.add_argument('--single', choices=list(BENCHMARKS), help=argparse.SUPPRESS)
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='Compare two results files')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.single:
+        print(json.dumps(run_once(args.single, args.work_dir)))
+        return
+
+    tree_args = {'n_suites': args.suites, 'n_cycles': args.cycles, 'max_reps': args.reps,
+                 'fail_frac': args.fail, 'activity_frac': args.activity,
+                 'missing_frac': args.missing, 'seed': args.seed}
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='cylc_log_bench_')
+    try:
+        if not os.path.isfile(os.path.join(work_dir, 'suite_status.csv')):
+            print('Generating synthetic log tree in', work_dir)
+            prepare(work_dir, tree_args)
+
+        results = {}
+        for name in args.benchmarks:
+            results[name] = run_benchmark(name, work_dir, args.repeats)
+            print('{:12s} wall {:8.3f} s  cpu {:8.3f} s  max rss {:8d} kB'.format(
+                name, results[name]['wall_median'], results[name]['cpu_median'],
+                results[name]['max_rss_kb']))
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir)
+
+    with open(args.out_file, 'w') as f:
+        json.dump({'revision': git_revision(), 'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                   'params': tree_args, 'results': results}, f, indent=2)
+
+
+if __name__=="__main__":
+    main()
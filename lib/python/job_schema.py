@@ -0,0 +1,138 @@
+"""Column types for cylc job data frames.
+
+Job data is indexed by batch id. String columns with few distinct values are
+categoricals, batch id and rep are nullable integers, timestamps are
+timezone-aware (UTC) and run and queue times are float32. Cycle points stay
+strings, as cylc writes them (e.g. 18500230T0000Z), as they may be dates in a
+360 day calendar. They sort in cycle order. This takes a
+fraction of the memory of object columns, and makes comparisons and isin
+filters on the categorical columns cheap.
+
+Readers apply the schema on load and check the result, so badly formed
+data is reported where it is read.
+"""
+
+import pandas as pd
+
+INDEX_COL = 'Batch id'
+SUITE_COL = 'Suite id'
+
+# Columns every job data file has
+JOB_COLS = ['Cycle', 'Rep', 'Submit time', 'Init time', 'Exit time', 'Exit status']
+
+DATETIME_COLS = ['Submit time', 'Init time', 'Exit time']
+CYCLE_COLS = ['Cycle']
+CYCLE_FORMAT = '%Y%m%dT%H%MZ'
+INT_COLS = ['Rep']
+FLOAT32_COLS = ['Queued time (s)', 'Elapsed time (s)']
+# Categorical columns, with categories that must always be available
+# so derived values can be assigned to them
+CATEGORIES = {'Suite id': [],
+              'Exit status': ['SUCCEEDED', 'EXIT'],
+              'File system': ['Disk', 'NVMe'],
+              'Task': []}
+
+
+class SchemaError(ValueError):
+    """Job data doesn't match the schema."""
+
+
+def as_category(values, categories=()):
+    """Values as categorical, with categories added if missing."""
+    values = values.astype('category')
+    missing = [cat for cat in categories if cat not in values.cat.categories]
+    if missing:
+        values = values.cat.add_categories(missing)
+    return values
+
+
+def as_cycles(values):
+    """Cycle points as strings in cylc's basic format. Datetimes and dates in
+    extended format (e.g. 1850-01-01), such as those written before cycle
+    points were kept as strings, are converted."""
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        return values.dt.strftime(CYCLE_FORMAT)
+    if not pd.api.types.is_string_dtype(values.dtype):
+        return values.astype(object).where(values.notna(), None)
+    extended = values.str.contains('-', na=False)
+    if extended.any():
+        values = values.where(~extended, pd.to_datetime(
+            values[extended], utc=True, format='ISO8601').dt.strftime(CYCLE_FORMAT))
+    return values
+
+
+def cycle_year_month(cycles):
+    """Year and month of cycle points, as floats (NaN if missing)."""
+    cycles = as_cycles(cycles)
+    year = pd.to_numeric(cycles.str[:4], errors='coerce').astype('float64')
+    month = pd.to_numeric(cycles.str[4:6], errors='coerce').astype('float64')
+    return year, month
+
+
+def apply_schema(data):
+    """Convert columns of job data present to their schema types."""
+    try:
+        if data.index.name == INDEX_COL and data.index.dtype != 'Int64':
+            data.index = pd.Index(pd.to_numeric(data.index).astype('Int64'), name=INDEX_COL)
+        for col in DATETIME_COLS:
+            if col in data.columns and not isinstance(data[col].dtype, pd.DatetimeTZDtype):
+                data[col] = pd.to_datetime(data[col], utc=True)
+        for col in CYCLE_COLS:
+            if col in data.columns:
+                data[col] = as_cycles(data[col])
+        for col in INT_COLS:
+            if col in data.columns and data[col].dtype != 'Int64':
+                data[col] = pd.to_numeric(data[col]).astype('Int64')
+        for col in FLOAT32_COLS:
+            if col in data.columns and data[col].dtype != 'float32':
+                data[col] = data[col].astype('float32')
+        for col, categories in CATEGORIES.items():
+            if col in data.columns:
+                data[col] = as_category(data[col], categories)
+    except (ValueError, TypeError) as err:
+        raise SchemaError('Failed to convert job data: {}'.format(err)) from err
+    return data
+
+
+def validate(data, required=(), source=None):
+    """Check job data has the required columns, and that all columns in the
+    schema have their schema types. Returns data."""
+    where = '' if source is None else ' in {}'.format(source)
+    missing = [col for col in required if col not in data.columns]
+    if missing:
+        raise SchemaError('Missing columns{}: {}'.format(where, ', '.join(missing)))
+
+    if data.index.name != INDEX_COL or data.index.dtype != 'Int64':
+        raise SchemaError('Index{} should be {} (Int64), not {} ({})'.format(
+            where, INDEX_COL, data.index.name, data.index.dtype))
+    for col in data.columns:
+        dtype = data[col].dtype
+        if col in DATETIME_COLS:
+            valid = isinstance(dtype, pd.DatetimeTZDtype)
+        elif col in CYCLE_COLS:
+            valid = pd.api.types.is_string_dtype(dtype)
+        elif col in INT_COLS:
+            valid = dtype == 'Int64'
+        elif col in FLOAT32_COLS:
+            valid = dtype == 'float32'
+        elif col in CATEGORIES:
+            valid = isinstance(dtype, pd.CategoricalDtype)
+        else:
+            continue
+        if not valid:
+            raise SchemaError('Column {}{} has wrong type {}'.format(col, where, dtype))
+    return data
+
+
+def read_csv(source, required=JOB_COLS):
+    """Read job data CSV file, apply the schema and check it."""
+    dtypes = {col: 'category' for col in CATEGORIES}
+    dtypes.update({col: 'float32' for col in FLOAT32_COLS})
+    dtypes.update({col: str for col in CYCLE_COLS})
+    data = pd.read_csv(source, index_col=INDEX_COL, dtype=dtypes)
+    name = source if isinstance(source, str) else None
+    try:
+        data = apply_schema(data)
+    except SchemaError as err:
+        raise SchemaError('{}{}'.format(err, '' if name is None else ' in '+name)) from err
+    return validate(data, required, name)
@@ -0,0 +1,120 @@
+"""Columnar store for cylc job data.
+
+Job data is stored as Parquet, partitioned by task and suite:
+
+    <store dir>/<task>/Suite id=<suite>/data.parquet
+
+Columns are stored with their job_schema types, so readers don't need to
+re-parse them, and can read just the suites and columns they need. The store
+is optional and needs pyarrow. The CSV files remain the primary outputs.
+
+Files are written in row groups of ROW_GROUP_SIZE jobs. Jobs are stored in
+roughly the order they ran, so filters on times skip row groups using their
+statistics, as well as skipping suites by partition.
+"""
+
+import os
+import shutil
+import pandas as pd
+import job_schema
+from job_schema import SUITE_COL, INDEX_COL
+
+try:
+    import pyarrow
+    HAVE_PARQUET = True
+except ImportError:
+    HAVE_PARQUET = False
+
+ROW_GROUP_SIZE = 5000
+
+def task_dir(store_dir, task):
+    """Directory holding data for a task."""
+    return os.path.join(store_dir, task)
+
+
+def suite_file(store_dir, task, suite):
+    """Parquet file holding data for a suite and task."""
+    return os.path.join(task_dir(store_dir, task),
+                        '{}={}'.format(SUITE_COL, suite), 'data.parquet')
+
+
+def has_task(store_dir, task):
+    """Check whether the store has data for a task. An empty store_dir
+    means there is no store."""
+    return (HAVE_PARQUET and bool(store_dir)
+            and os.path.isdir(task_dir(store_dir, task)))
+
+
+def check_parquet():
+    """Raise an error if Parquet support is not available."""
+    if not HAVE_PARQUET:
+        raise ImportError('pyarrow is required for the job data store')
+
+
+def write_suite(data, store_dir, task, suite):
+    """Write job data for a single suite and task, replacing any existing data."""
+    check_parquet()
+    data = job_schema.apply_schema(data.drop(columns=[SUITE_COL], errors='ignore'))
+    data = data.reset_index()
+
+    path = suite_file(store_dir, task, suite)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = os.path.join(os.path.dirname(path), '.data.parquet.tmp')
+    data.to_parquet(tmp_path, index=False, row_group_size=ROW_GROUP_SIZE)
+    os.replace(tmp_path, path)
+
+
+def stored_suites(store_dir, task):
+    """Suites with data stored for a task."""
+    path = task_dir(store_dir, task)
+    if not os.path.isdir(path):
+        return []
+    prefix = SUITE_COL + '='
+    return [name[len(prefix):] for name in os.listdir(path) if name.startswith(prefix)]
+
+
+def remove_suite(store_dir, task, suite):
+    """Remove data for a suite and task, if there is any."""
+    path = os.path.dirname(suite_file(store_dir, task, suite))
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+
+
+def write_task(data, store_dir, task):
+    """Write job data for all suites for a task, replacing any existing data."""
+    check_parquet()
+    path = task_dir(store_dir, task)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    for suite, suite_data in data.groupby(SUITE_COL, sort=False, observed=True):
+        write_suite(suite_data, store_dir, task, suite)
+
+
+def read_task(store_dir, task, suites=None, columns=None, filters=None):
+    """Read job data for a task, optionally only for some suites and columns,
+    and only rows matching filters, as (column, op, value) tuples.
+    Returns dataframe indexed by batch id, with schema types."""
+    check_parquet()
+    filters = list(filters or [])
+    if suites is not None:
+        filters.append((SUITE_COL, 'in', list(suites)))
+    filters = filters or None
+    if columns is not None:
+        columns = [INDEX_COL] + [col for col in columns if col != INDEX_COL]
+
+    data = pd.read_parquet(task_dir(store_dir, task), columns=columns, filters=filters)
+    data = job_schema.apply_schema(data.set_index(INDEX_COL))
+    return job_schema.validate(data, source=task_dir(store_dir, task))
+
+
+def write_table(data, path):
+    """Write a single table, e.g. suite status, keeping its index."""
+    check_parquet()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data.to_parquet(path)
+
+
+def read_table(path):
+    """Read a single table written by write_table."""
+    check_parquet()
+    return pd.read_parquet(path)
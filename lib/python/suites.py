@@ -0,0 +1,20 @@
+"""Suites listed in the suite status file, and their log directories."""
+
+import csv
+import os
+
+
+def get_suites(suite_status_file, process_all):
+    """List suites to process from suite status file."""
+    with open(suite_status_file, newline='') as f:
+        return [row['Suite id'] for row in csv.DictReader(f)
+                if process_all or row['Process logs'] == 'True']
+
+
+def latest_log_dir(suite_dir):
+    """Latest log dir of a suite in the archive, or None."""
+    logs = sorted(name for name in os.listdir(suite_dir)
+                  if 'log' in name and not name.startswith('.'))
+    if not logs:
+        return None
+    return os.path.join(suite_dir, logs[-1])
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+"""Timing and counts for stages of workflow tasks.
+
+Each stage appends a JSON line to the metrics file (PIPELINE_METRICS, by
+default DATA_DIR/pipeline_metrics.jsonl) with the task, cycle, stage and
+suite, wall and CPU time, peak RSS and counts of files scanned, bytes read
+and rows produced:
+
+    with task_metrics.Stage('extract', suite=suite) as s:
+        ...
+        s.add(files=n_files, bytes=n_bytes, rows=n_rows)
+
+CPU time includes child processes that finished during the stage, e.g. a
+pool of workers. Peak RSS is the largest of this process so far and its
+children. Stages can be nested, and run in worker processes: lines are
+appended under a lock. If PROFILE_DIR is set, the outermost stage in each
+process is also profiled with cProfile, to
+PROFILE_DIR/<task>_<cycle>_<stage>[_<suite>].prof, unless the stage is
+created with profile=False.
+
+From bash, time a command as a stage with:
+
+    python -m task_metrics run --stage <stage> [--suite <suite>] -- <command>
+
+Commands run like this aren't profiled, as only the wait for the command
+would be.
+
+Metrics are never allowed to make a task fail. If the metrics file can't be
+written, a warning is printed and the task carries on.
+"""
+
+import argparse
+import cProfile
+import fcntl
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+METRICS_FILE = 'pipeline_metrics.jsonl'
+COUNTS = ['files', 'bytes', 'rows']
+
+# Whether a stage in this process is being profiled
+_profiling = False
+
+
+def metrics_file():
+    """Path of metrics file, or None if there's nowhere to write it."""
+    path = os.environ.get('PIPELINE_METRICS')
+    if path:
+        return path
+    data_dir = os.environ.get('DATA_DIR')
+    if data_dir and os.path.isdir(data_dir):
+        return os.path.join(data_dir, METRICS_FILE)
+    return None
+
+
+def task_name():
+    """Cylc task name, or script name outside cylc."""
+    return os.environ.get('CYLC_TASK_NAME') or os.path.basename(sys.argv[0])
+
+
+def usage():
+    """(CPU time, peak RSS in kB) of this process and its finished children."""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+    return cpu, max(own.ru_maxrss, children.ru_maxrss)
+
+
+def write_record(record, path=None):
+    """Append a record to the metrics file, under a lock."""
+    path = path or metrics_file()
+    if path is None:
+        return
+    try:
+        with open(path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(json.dumps(record) + '\n')
+    except OSError as err:
+        print('Warning: failed to write metrics to {}: {}'.format(path, err), file=sys.stderr)
+
+
+def read_records(path):
+    """Read all records from a metrics file."""
+    records = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                records.append(json.loads(line))
+    return records
+
+
+class Stage:
+    """Context manager recording the metrics of a stage."""
+
+    def __init__(self, name, suite=None, profile=True, **counts):
+        self.name = name
+        self.suite = suite
+        self.counts = dict.fromkeys(COUNTS, 0)
+        self.add(**counts)
+        self.ok = True
+        self.profile = profile
+        self.profiler = None
+
+    def add(self, **counts):
+        """Add to counts of files, bytes or rows."""
+        for key, value in counts.items():
+            if key not in self.counts:
+                raise ValueError('Unknown count: {}'.format(key))
+            self.counts[key] += int(value or 0)
+
+    def profile_file(self):
+        """File to write profile to."""
+        parts = [task_name(), os.environ.get('CYLC_TASK_CYCLE_POINT', ''), self.name, self.suite]
+        name = '_'.join(part for part in parts if part)
+        return os.path.join(os.environ['PROFILE_DIR'], name + '.prof')
+
+    def __enter__(self):
+        global _profiling
+        if self.profile and os.environ.get('PROFILE_DIR') and not _profiling:
+            _profiling = True
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.start = time.time()
+        self.start_cpu = usage()[0]
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        global _profiling
+        wall = time.time() - self.start
+        cpu, max_rss = usage()
+        if self.profiler is not None:
+            self.profiler.disable()
+            _profiling = False
+            try:
+                os.makedirs(os.environ['PROFILE_DIR'], exist_ok=True)
+                self.profiler.dump_stats(self.profile_file())
+            except OSError as err:
+                print('Warning: failed to write profile: {}'.format(err), file=sys.stderr)
+
+        record = {'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                  'task': task_name(),
+                  'cycle': os.environ.get('CYLC_TASK_CYCLE_POINT'),
+                  'stage': self.name,
+                  'suite': self.suite,
+                  'wall': round(wall, 3),
+                  'cpu': round(cpu - self.start_cpu, 3),
+                  'max_rss_kb': max_rss,
+                  'ok': self.ok and exc_type is None}
+        record.update(self.counts)
+        write_record(record)
+        return False
+
+
+def run_command(name, suite, command):
+    """Run a command as a stage. Returns its exit code."""
+    with Stage(name, suite, profile=False) as s:
+        code = subprocess.call(command)
+        s.ok = code == 0
+    return code
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Record metrics of workflow task stages.')
+    subparsers = parser.add_subparsers(dest='action')
+    run = subparsers.add_parser('run', help='Run a command as a stage')
+    run.add_argument('--stage', required=True, help='Stage name')
+    run.add_argument('--suite', help='Suite id')
+    run.add_argument('command', nargs=argparse.REMAINDER, help='Command, after --')
+    args = parser.parse_args()
+
+    if args.action != 'run':
+        parser.print_help()
+        sys.exit(2)
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+    if not command:
+        parser.error('No command given')
+    sys.exit(run_command(args.stage, args.suite, command))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+"""Watermarks of files read incrementally.
+
+A watermark is the size, mtime and digest of a file when it was last read.
+If the file has since grown and the digest of its first size bytes is
+unchanged, only the bytes after size are new.
+"""
+
+import hashlib
+
+
+def file_digest(path, size):
+    """SHA1 digest of the first size bytes of a file."""
+    digest = hashlib.sha1()
+    remaining = size
+    with open(path, 'rb') as f:
+        while remaining > 0:
+            chunk = f.read(min(remaining, 1 << 20))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest.hexdigest()
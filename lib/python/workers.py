@@ -0,0 +1,13 @@
+"""Number of worker processes for tasks that run on a pool of workers."""
+
+import os
+
+
+def default_nprocs(limit=None):
+    """Number of cores available to this job, e.g. in the LOTUS allocation,
+    and at most limit, e.g. on a shared server."""
+    try:
+        nprocs = len(os.sched_getaffinity(0))
+    except AttributeError:
+        nprocs = os.cpu_count() or 1
+    return min(nprocs, limit) if limit else nprocs
@@ -0,0 +1,10 @@
+"""Put the workflow's Python code on the path, as cylc and rose do for
+task jobs, and the benchmark's synthetic log trees."""
+
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for path in ['lib/python', 'app/process_logs/bin', 'app/analyse_data/bin', 'benchmark']:
+    sys.path.insert(0, os.path.join(REPO_DIR, path))
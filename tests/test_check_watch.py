@@ -0,0 +1,70 @@
+"""check_watch starts watch_logs unless it's running, and fails if it's hung."""
+
+import fcntl
+import json
+import os
+import time
+import pytest
+from scripts import load_script
+
+
+check_watch = load_script('check_watch')
+
+STALE = 600
+
+
+def write_status(watch_dir, status, age):
+    heartbeat = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() - age))
+    with open(os.path.join(watch_dir, check_watch.STATUS_FILE), 'w') as f:
+        json.dump({'status': status, 'heartbeat': heartbeat, 'host': 'sci1', 'pid': 1,
+                   'mode': 'poll', 'started': heartbeat, 'jobs': 0, 'batches': 0,
+                   'last batch': None, 'errors': 0, 'pending': 0, 'open jobs': 0}, f)
+
+
+@pytest.fixture
+def lock(tmp_path):
+    """Hold the watch lock, as a running watch_logs does."""
+    with open(tmp_path / check_watch.LOCK_FILE, 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def run(watch_dir):
+    """Run check, returning error and whether the watch was started."""
+    started = []
+    error = check_watch.check_watch(str(watch_dir), STALE,
+                                    start=lambda watch_dir: started.append(watch_dir) or 1)
+    return error, bool(started)
+
+
+def test_never_run(tmp_path):
+    assert run(tmp_path) == (None, True)
+
+
+def test_running(tmp_path, lock):
+    write_status(tmp_path, 'running', 10)
+    assert run(tmp_path) == (None, False)
+
+
+def test_catching_up(tmp_path, lock):
+    # Old status file, while a new watch catches up
+    write_status(tmp_path, 'stopped', 2*STALE)
+    assert run(tmp_path) == (None, False)
+
+
+def test_hung(tmp_path, lock):
+    write_status(tmp_path, 'running', 2*STALE)
+    error, started = run(tmp_path)
+    assert error is not None and not started
+
+
+def test_stopped(tmp_path):
+    write_status(tmp_path, 'stopped', 2*STALE)
+    assert run(tmp_path) == (None, True)
+
+
+def test_died(tmp_path):
+    write_status(tmp_path, 'running', 2*STALE)
+    open(tmp_path / check_watch.LOCK_FILE, 'w').close()
+    assert run(tmp_path) == (None, True)
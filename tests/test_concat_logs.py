@@ -0,0 +1,118 @@
+"""Incremental concat_logs must match a full rebuild."""
+
+import os
+import pytest
+from scripts import load_script
+from cylc_job_logs import data_header, job_data_row, process_job_data
+import job_store
+
+
+concat_logs = load_script('concat_logs')
+
+TASK = 'coupled'
+SUITE_STATUS_HEADER = 'Suite id,First cycle,Start time\n'
+
+
+class Tree:
+    """Processed job data for some suites, and the files concat_logs writes."""
+
+    def __init__(self, root):
+        self.root = str(root)
+        self.proc_dir = os.path.join(self.root, 'processed')
+        self.suite_status = os.path.join(self.root, 'suite_status.csv')
+        self.out_file = os.path.join(self.root, '{}_jobs.csv'.format(TASK))
+        self.work_dir = os.path.join(self.root, 'concat')
+        self.store_dir = os.path.join(self.root, 'store')
+        self.mtime = 1700000000
+
+    def set_suites(self, suites):
+        with open(self.suite_status, 'w') as f:
+            f.write(SUITE_STATUS_HEADER)
+            for suite in suites:
+                f.write('{},18500101T0000Z,2023-01-01T00:00:00Z\n'.format(suite))
+
+    def write_jobs(self, suite, jobs, batch_base):
+        """Write processed file for a suite with jobs (cycle, exit status)."""
+        suite_dir = os.path.join(self.proc_dir, suite)
+        os.makedirs(suite_dir, exist_ok=True)
+        raw_file = os.path.join(self.root, 'raw.csv')
+        with open(raw_file, 'w') as f:
+            f.write(data_header(TASK))
+            for i, (cycle, exit_status) in enumerate(jobs):
+                status = {'CYLC_BATCH_SYS_JOB_ID': str(batch_base + i),
+                          'CYLC_BATCH_SYS_JOB_SUBMIT_TIME': '2023-01-01T00:00:00Z',
+                          'CYLC_JOB_INIT_TIME': '2023-01-01T01:00:00Z',
+                          'CYLC_JOB_EXIT_TIME': '2023-01-01T0{}:00:00Z'.format(2 + i % 7),
+                          'CYLC_JOB_EXIT': exit_status}
+                f.write(job_data_row(TASK, cycle, '01', status))
+        proc_file = os.path.join(suite_dir, '{}_cylc.csv'.format(TASK))
+        process_job_data(raw_file, proc_file)
+        # Files written in quick succession can share an mtime
+        self.mtime += 60
+        os.utime(proc_file, (self.mtime, self.mtime))
+
+    def concat(self):
+        """Run incremental concat, check it matches a full rebuild.
+        Returns suites updated."""
+        updated = concat_logs.concat_suite_logs_incremental(
+            TASK, self.suite_status, self.proc_dir, self.out_file, self.work_dir,
+            self.store_dir if job_store.HAVE_PARQUET else None)
+        full_file = self.out_file + '.full'
+        concat_logs.concat_suite_logs(TASK, self.suite_status, self.proc_dir, full_file)
+        with open(self.out_file) as f1, open(full_file) as f2:
+            assert f1.read() == f2.read()
+        return updated
+
+
+def cycles(start, n):
+    return [('{}0101T0000Z'.format(1850 + year), 'SUCCEEDED') for year in range(start, start+n)]
+
+
+@pytest.fixture
+def tree(tmp_path):
+    tree = Tree(tmp_path)
+    tree.set_suites(['u-aa001', 'u-aa002', 'u-aa003'])
+    for i, suite in enumerate(['u-aa001', 'u-aa002', 'u-aa003']):
+        tree.write_jobs(suite, cycles(0, 3), 1000 * (i+1))
+    assert tree.concat() == ['u-aa001', 'u-aa002', 'u-aa003']
+    return tree
+
+
+def test_unchanged(tree):
+    assert tree.concat() == []
+
+
+def test_append_last_suite(tree):
+    tree.write_jobs('u-aa003', cycles(0, 5), 3000)
+    assert tree.concat() == ['u-aa003']
+
+
+def test_append_middle_suite(tree):
+    tree.write_jobs('u-aa002', cycles(0, 4), 2000)
+    assert tree.concat() == ['u-aa002']
+
+
+def test_rewrite_suite(tree):
+    jobs = cycles(0, 3)
+    jobs[1] = (jobs[1][0], 'EXIT')
+    tree.write_jobs('u-aa001', jobs, 1000)
+    assert tree.concat() == ['u-aa001']
+
+
+def test_suite_removed(tree):
+    tree.set_suites(['u-aa001', 'u-aa003'])
+    assert tree.concat() == []
+    if job_store.HAVE_PARQUET:
+        assert sorted(job_store.stored_suites(tree.store_dir, TASK)) == ['u-aa001', 'u-aa003']
+
+
+def test_suite_added(tree):
+    tree.set_suites(['u-aa001', 'u-aa002', 'u-aa003', 'u-aa004'])
+    tree.write_jobs('u-aa004', cycles(0, 2), 4000)
+    assert tree.concat() == ['u-aa004']
+    tree.set_suites(['u-aa000', 'u-aa001', 'u-aa002', 'u-aa003', 'u-aa004'])
+    tree.write_jobs('u-aa000', cycles(0, 2), 500)
+    assert tree.concat() == ['u-aa000']
+    if job_store.HAVE_PARQUET:
+        assert sorted(job_store.stored_suites(tree.store_dir, TASK)) == [
+            'u-aa000', 'u-aa001', 'u-aa002', 'u-aa003', 'u-aa004']
@@ -0,0 +1,140 @@
+"""Reading jobs from a workflow database from the watermark on must match
+reading all of them, as jobs are added and finish, and when the database
+is replaced."""
+
+import json
+import os
+import shutil
+import sqlite3
+import pytest
+from cylc_db_jobs import extract_db_job_data, state_path
+from make_log_tree import write_db, make_tree
+
+TASK = 'coupled'
+
+
+def db_path(tree_dir):
+    """Database of the one suite in a synthetic tree."""
+    return str(next((tree_dir / 'logs' / 'u-bm000').glob('log.*/db')))
+
+
+def read_rows(db_file):
+    conn = sqlite3.connect(db_file)
+    rows = conn.execute('SELECT * FROM task_jobs ORDER BY rowid').fetchall()
+    conn.close()
+    return rows
+
+
+def update(db_file, sql, *args):
+    conn = sqlite3.connect(db_file)
+    with conn:
+        conn.execute(sql, args)
+    conn.close()
+
+
+def unfinish(db_file, cycle, submit_num, ran=True):
+    """Set a job back to running, or just submitted if not ran."""
+    update(db_file, 'UPDATE task_jobs SET time_run_exit = NULL, run_signal = NULL, '
+           'run_status = NULL WHERE cycle = ? AND name = ? AND submit_num = ?',
+           cycle, TASK, submit_num)
+    if not ran:
+        update(db_file, 'UPDATE task_jobs SET time_run = NULL WHERE cycle = ? AND name = ? '
+               'AND submit_num = ?', cycle, TASK, submit_num)
+
+
+class Extract:
+    """Raw file updated from the watermark on, checked against a rebuild."""
+
+    def __init__(self, root, db_file):
+        self.root = str(root)
+        self.db_file = db_file
+        self.out_file = os.path.join(self.root, '{}_cylc.csv'.format(TASK))
+
+    def update(self):
+        count = extract_db_job_data(self.db_file, TASK, self.out_file)
+        full_file = os.path.join(self.root, 'full', '{}_cylc.csv'.format(TASK))
+        os.makedirs(os.path.dirname(full_file), exist_ok=True)
+        for path in [full_file, state_path(full_file)]:
+            if os.path.exists(path):
+                os.remove(path)
+        extract_db_job_data(self.db_file, TASK, full_file)
+        with open(self.out_file) as f1, open(full_file) as f2:
+            assert f1.read() == f2.read()
+        return count
+
+    def state(self):
+        with open(state_path(self.out_file)) as f:
+            return json.load(f)
+
+
+@pytest.fixture
+def rows(tmp_path):
+    """task_jobs rows of a synthetic suite, with some jobs resubmitted."""
+    make_tree(str(tmp_path / 'tree'), n_suites=1, n_cycles=20, fail_frac=0.3, db=True)
+    return read_rows(db_path(tmp_path / 'tree'))
+
+
+def job_rowid(rows, cycle, submit_num):
+    for rowid, row in enumerate(rows, 1):
+        if row[:3] == (cycle, TASK, submit_num):
+            return rowid
+
+
+def end_rowid(rows):
+    """Watermark once all jobs of the task have finished."""
+    return max(rowid for rowid, row in enumerate(rows, 1) if row[1] == TASK) + 1
+
+
+def test_jobs_added_and_finished(tmp_path, rows):
+    db_file = str(tmp_path / 'db')
+    write_db(db_file, rows[:20])
+    coupled = [row for row in rows[:20] if row[1] == TASK]
+    unfinish(db_file, coupled[-1][0], coupled[-1][2])
+    extract = Extract(tmp_path, db_file)
+    assert extract.update() == len(coupled)
+    rowid = job_rowid(rows, coupled[-1][0], coupled[-1][2])
+    assert extract.state()['rowid'] == rowid
+
+    # Nothing new, only the unfinished job is read again
+    assert extract.update() == 1
+
+    # Job finishes and more are added
+    write_db(str(tmp_path / 'db.new'), rows)
+    os.replace(str(tmp_path / 'db.new'), db_file)
+    assert extract.update() == len([row for row in rows[rowid-1:] if row[1] == TASK])
+    assert extract.state()['rowid'] == end_rowid(rows)
+
+
+def test_resubmitted_job_never_ran(tmp_path, rows):
+    # A job that never ran doesn't hold the watermark once it's resubmitted
+    cycle = [row[0] for row in rows if row[1] == TASK and row[2] == 2][0]
+    db_file = str(tmp_path / 'db')
+    write_db(db_file, rows)
+    unfinish(db_file, cycle, 1, ran=False)
+    extract = Extract(tmp_path, db_file)
+    extract.update()
+    assert extract.state()['rowid'] == end_rowid(rows)
+
+    # But does while it's waiting to run
+    update(db_file, 'DELETE FROM task_jobs WHERE rowid >= ?', job_rowid(rows, cycle, 2))
+    extract.update()
+    assert extract.state()['rowid'] == job_rowid(rows, cycle, 1)
+
+
+def test_database_replaced(tmp_path, rows):
+    db_file = str(tmp_path / 'db')
+    write_db(db_file, rows)
+    coupled = [row for row in rows if row[1] == TASK]
+    unfinish(db_file, coupled[-1][0], coupled[-1][2])
+    extract = Extract(tmp_path, db_file)
+    extract.update()
+
+    # Rewritten with an earlier job gone, the last one read is still there
+    update(db_file, 'DELETE FROM task_jobs WHERE cycle = ? AND name = ?', coupled[1][0], TASK)
+    assert extract.update() == len(coupled) - 1
+
+    # Reinstalled, with different jobs
+    make_tree(str(tmp_path / 'other'), n_suites=1, n_cycles=10, seed=2, db=True)
+    other_db = db_path(tmp_path / 'other')
+    shutil.copy(other_db, db_file)
+    assert extract.update() == len([row for row in read_rows(other_db) if row[1] == TASK])
@@ -0,0 +1,56 @@
+"""Cycle points in a 360 day calendar, such as 30 February, must load."""
+
+import pandas as pd
+import job_schema
+from cylc_job_logs import data_header, job_data_row, process_job_data
+from suite_stats import SuiteStats
+
+TASK = 'coupled'
+CYCLES = ['18500130T0000Z', '18500230T0000Z', '18500330T0000Z']
+
+
+def write_jobs(path, cycles):
+    with open(path, 'w') as f:
+        f.write(data_header(TASK))
+        for i, cycle in enumerate(cycles):
+            status = {'CYLC_BATCH_SYS_JOB_ID': str(1000 + i),
+                      'CYLC_BATCH_SYS_JOB_SUBMIT_TIME': '2023-01-0{}T00:00:00Z'.format(i+1),
+                      'CYLC_JOB_INIT_TIME': '2023-01-0{}T01:00:00Z'.format(i+1),
+                      'CYLC_JOB_EXIT_TIME': '2023-01-0{}T02:00:00Z'.format(i+1),
+                      'CYLC_JOB_EXIT': 'SUCCEEDED'}
+            f.write(job_data_row(TASK, cycle, '01', status))
+
+
+def test_process_360_day_cycles(tmp_path):
+    raw_file, proc_file = str(tmp_path / 'raw.csv'), str(tmp_path / 'proc.csv')
+    write_jobs(raw_file, CYCLES)
+    process_job_data(raw_file, proc_file)
+    jobs = job_schema.read_csv(proc_file)
+    assert jobs['Cycle'].tolist() == CYCLES
+    assert jobs['Elapsed time (s)'].tolist() == [3600.0] * 3
+    assert jobs.sort_values('Cycle')['Cycle'].tolist() == CYCLES
+
+
+def test_old_cycle_datetimes():
+    # Processed files from before cycle points were kept as strings
+    cycles = pd.Series(['1850-01-01 00:00:00+00:00', '18500230T0000Z', None])
+    assert job_schema.as_cycles(cycles).tolist()[:2] == ['18500101T0000Z', '18500230T0000Z']
+    year, month = job_schema.cycle_year_month(cycles)
+    assert year.tolist()[:2] == [1850.0, 1850.0] and month.tolist()[:2] == [1.0, 2.0]
+    assert year.isna().tolist() == [False, False, True]
+
+
+def test_suite_stats_last_cycle(tmp_path):
+    suite_dir = tmp_path / 'processed' / 'u-aa001'
+    suite_dir.mkdir(parents=True)
+    raw_file = str(tmp_path / 'raw.csv')
+    write_jobs(raw_file, CYCLES[:2])
+    process_job_data(raw_file, str(suite_dir / 'coupled_cylc.csv'))
+
+    class Status:
+        suites = ['u-aa001']
+        data = pd.DataFrame({'Cycle length (days)': [30]}, index=pd.Index(suites, name='Suite id'))
+
+    stats = SuiteStats(str(tmp_path / 'state.json'))
+    stats.update(str(tmp_path / 'processed'), Status)
+    assert stats.aggregates().loc['u-aa001', 'Last completed cycle'] == '18500230T0000Z'
@@ -0,0 +1,25 @@
+"""Copying with tar must not block on a file list bigger than a pipe."""
+
+import os
+import threading
+import log_transfer
+
+
+def test_copy_many_files_with_tar(tmp_path):
+    src_dir, dest = tmp_path / 'src', str(tmp_path / 'dest')
+    rel_paths = []
+    for i in range(3000):
+        rel = 'log.20230101T000000Z/job/1850{:04d}T0000Z/coupled/{:02d}/job.status'.format(
+            i % 400, i // 400)
+        (src_dir / os.path.dirname(rel)).mkdir(parents=True, exist_ok=True)
+        (src_dir / rel).write_bytes(os.urandom(2000))
+        rel_paths.append(rel)
+
+    result = []
+    copy = threading.Thread(daemon=True, target=lambda: result.append(
+        log_transfer.copy_files('tar', str(src_dir), rel_paths, dest)))
+    copy.start()
+    copy.join(60)
+    assert result == [None]
+    sizes = {rel: size for rel, (size, _) in log_transfer.scan_files(dest).items()}
+    assert sizes == {rel: 2000 for rel in rel_paths}
@@ -0,0 +1,196 @@
+"""watch_logs finds new and changed jobs, carries on from its checkpoint,
+picks up suite status changes, and stops cleanly on SIGTERM."""
+
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import time
+import pytest
+from scripts import BIN_DIR, load_script
+from conftest import REPO_DIR
+from cylc_job_logs import extract_job_data, scan_job_files
+from log_watch import IN_CREATE, IN_ISDIR, IN_Q_OVERFLOW, Debouncer, JobTree
+
+watch_logs = load_script('watch_logs')
+
+LOG = 'log.20230101T000000Z'
+TASKS = ['coupled', 'pptransfer']
+
+
+def write_job(archive_dir, suite, cycle, rep='01', task='coupled', finished=True):
+    """Write job.status for a job, which has exited if finished.
+    Returns job dir relative to the archive."""
+    rel = '/'.join([suite, LOG, 'job', cycle, task, rep])
+    job_dir = os.path.join(archive_dir, rel)
+    os.makedirs(job_dir, exist_ok=True)
+    batch_id = 1000 * int(suite[-3:]) + int(cycle[:4]) - 1850 + int(rep) * 100
+    lines = ['CYLC_JOB_RUNNER_NAME=slurm',
+             'CYLC_BATCH_SYS_JOB_ID={}'.format(batch_id),
+             'CYLC_BATCH_SYS_JOB_SUBMIT_TIME=2023-01-01T00:00:00Z',
+             'CYLC_JOB_INIT_TIME=2023-01-01T01:00:00Z']
+    if finished:
+        lines += ['CYLC_JOB_EXIT=SUCCEEDED', 'CYLC_JOB_EXIT_TIME=2023-01-01T04:00:00Z']
+    # Directory mtimes only change from one clock tick to the next
+    time.sleep(0.02)
+    with open(os.path.join(job_dir, 'job.status'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return rel
+
+
+def write_suite_status(path, suites):
+    with open(path, 'w') as f:
+        f.write('Suite id,Process logs\n')
+        for suite in suites:
+            f.write('{},True\n'.format(suite))
+    # Rewritten within a clock tick of the last write in some tests
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+@pytest.fixture
+def archive_dir(tmp_path):
+    archive_dir = str(tmp_path / 'archive')
+    write_job(archive_dir, 'u-aa001', '18500101T0000Z')
+    write_job(archive_dir, 'u-aa001', '18510101T0000Z', finished=False)
+    return archive_dir
+
+
+def test_scan(archive_dir):
+    tree = JobTree(archive_dir, ['u-aa001'], TASKS)
+    done = 'u-aa001/{}/job/18500101T0000Z/coupled/01'.format(LOG)
+    running = 'u-aa001/{}/job/18510101T0000Z/coupled/01'.format(LOG)
+    assert tree.scan() == {done, running}
+    tree.set_open(running, scan_job_files(os.path.join(archive_dir, running)))
+    assert tree.scan() == set()
+
+    # New job, and an open job's files change
+    new = write_job(archive_dir, 'u-aa001', '18520101T0000Z')
+    write_job(archive_dir, 'u-aa001', '18510101T0000Z')
+    assert tree.scan() == {new, running}
+
+    # Finished jobs aren't checked again
+    tree.close(running)
+    write_job(archive_dir, 'u-aa001', '18510101T0000Z', finished=False)
+    assert tree.scan() == set()
+
+    # Cycles that have gone are forgotten
+    time.sleep(0.02)
+    shutil.rmtree(os.path.join(archive_dir, 'u-aa001', LOG, 'job', '18520101T0000Z'))
+    assert tree.scan() == set()
+    assert not [rel for rel in tree.dirs if '18520101T0000Z' in rel]
+
+
+def test_event(archive_dir):
+    tree = JobTree(archive_dir, ['u-aa001'], TASKS)
+    tree.scan()
+    rep = write_job(archive_dir, 'u-aa001', '18500101T0000Z', rep='02')
+    task_dir = os.path.dirname(os.path.join(archive_dir, rep))
+    assert tree.event(task_dir, '02', IN_CREATE | IN_ISDIR) == {rep}
+    assert tree.event(os.path.join(archive_dir, rep), 'job.status', IN_CREATE) == {rep}
+    assert tree.event(os.path.join(archive_dir, rep), 'job.err', IN_CREATE) == set()
+
+    # Events lost, so everything is scanned
+    new = write_job(archive_dir, 'u-aa001', '18520101T0000Z')
+    assert tree.event(None, '', IN_Q_OVERFLOW) == {new}
+
+
+def test_debouncer():
+    debouncer = Debouncer(10, pending=['a'])
+    # Pending keys from a checkpoint are ready straight away
+    assert debouncer.ready(now=100) == ['a']
+    debouncer.add(['b', 'c'], now=0)
+    debouncer.add(['c'], now=5)
+    assert debouncer.ready(now=9) == []
+    assert debouncer.ready(now=10) == ['b']
+    assert debouncer.ready(now=15) == ['c']
+    assert debouncer.pending == {}
+
+
+class Watch:
+    """Data and watch dirs for a LogWatch on an archive."""
+
+    def __init__(self, root, archive_dir):
+        self.root = str(root)
+        self.archive_dir = archive_dir
+        self.data_dir = os.path.join(self.root, 'data')
+        self.watch_dir = os.path.join(self.root, 'watch')
+        self.suite_status = os.path.join(self.root, 'suite_status.csv')
+        os.makedirs(self.watch_dir)
+
+    def start(self):
+        return watch_logs.LogWatch(self.archive_dir, self.data_dir, self.watch_dir,
+                                   self.suite_status, False, TASKS)
+
+    def raw_file(self, suite, task='coupled'):
+        return os.path.join(self.data_dir, 'raw', suite, '{}_cylc.csv'.format(task))
+
+    def assert_matches_full(self, suite):
+        """Raw file matches a full extract of the suite's logs."""
+        full_file = os.path.join(self.root, 'full.csv')
+        extract_job_data(os.path.join(self.archive_dir, suite), 'coupled', full_file)
+        with open(self.raw_file(suite)) as f1, open(full_file) as f2:
+            assert f1.read() == f2.read()
+
+
+def test_checkpoint_resume(tmp_path, archive_dir):
+    watch = Watch(tmp_path, archive_dir)
+    write_suite_status(watch.suite_status, ['u-aa001'])
+    log_watch = watch.start()
+    assert list(log_watch.tree.open) == ['u-aa001/{}/job/18510101T0000Z/coupled/01'.format(LOG)]
+    log_watch.checkpoint('stopped')
+
+    # Jobs land while the watch is stopped
+    new = write_job(archive_dir, 'u-aa001', '18520101T0000Z')
+    running = write_job(archive_dir, 'u-aa001', '18510101T0000Z')
+    log_watch = watch.start()
+    assert set(log_watch.debouncer.pending) == {new, running}
+    log_watch.process(log_watch.debouncer.ready(now=time.time() + 60))
+    assert log_watch.tree.open == {}
+    watch.assert_matches_full('u-aa001')
+
+
+def test_suite_status_changed(tmp_path, archive_dir):
+    write_job(archive_dir, 'u-aa002', '18500101T0000Z')
+    watch = Watch(tmp_path, archive_dir)
+    write_suite_status(watch.suite_status, ['u-aa001'])
+    log_watch = watch.start()
+    assert log_watch.check_suites() == []
+    assert not os.path.exists(watch.raw_file('u-aa002'))
+
+    write_suite_status(watch.suite_status, ['u-aa002'])
+    assert log_watch.check_suites() == ['u-aa002']
+    watch.assert_matches_full('u-aa002')
+    assert not [rel for rel in log_watch.tree.dirs if rel.startswith('u-aa001')]
+
+    # New jobs of the added suite are found
+    new = write_job(archive_dir, 'u-aa002', '18510101T0000Z')
+    assert log_watch.tree.scan() == {new}
+
+
+def test_sigterm(tmp_path, archive_dir):
+    watch = Watch(tmp_path, archive_dir)
+    write_suite_status(watch.suite_status, ['u-aa001'])
+    env = dict(os.environ, PYTHONPATH=os.path.join(REPO_DIR, 'lib', 'python'),
+               PROCESS_ALL='False', ARCHIVE_DIR=archive_dir, DATA_DIR=watch.data_dir,
+               SUITE_STATUS=watch.suite_status, TASKS=' '.join(TASKS),
+               WATCH_DIR=watch.watch_dir, WATCH_MODE='poll', WATCH_CHECKPOINT='1')
+    proc = subprocess.Popen([sys.executable, os.path.join(BIN_DIR, 'watch_logs')], env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    status_file = os.path.join(watch.watch_dir, watch_logs.STATUS_FILE)
+    try:
+        for _ in range(300):
+            if os.path.isfile(status_file):
+                break
+            time.sleep(0.1)
+        proc.send_signal(signal.SIGTERM)
+        output = proc.communicate(timeout=30)[0].decode()
+    finally:
+        proc.kill()
+    assert proc.returncode == 0, output
+    assert 'Stopping on signal' in output
+    with open(status_file) as f:
+        assert json.load(f)['status'] == 'stopped'
+    assert os.path.isfile(os.path.join(watch.watch_dir, watch_logs.STATE_FILE))
@@ -0,0 +1,45 @@
+"""Per-suite plots are only re-rendered for suites whose data changed."""
+
+import pandas as pd
+import job_schema
+from cylc_performance import PPTransferData
+from render_plots import spec_digest
+from rollups import DailyRollups, empty_tables, roll_up
+
+SUITES = ['u-aa001', 'u-aa002', 'u-aa003']
+
+
+def job_frame(jobs_per_suite, extra_suite=None):
+    """pptransfer jobs, one a day, optionally with one more for a suite."""
+    rows = []
+    for i, suite in enumerate(SUITES):
+        n = jobs_per_suite + (suite == extra_suite)
+        for day in range(n):
+            start = pd.Timestamp('2023-01-01', tz='UTC') + pd.Timedelta(days=day)
+            rows.append({'Batch id': 1000*(i+1) + day, 'Suite id': suite, 'Rep': 1,
+                         'Cycle': start, 'Submit time': start, 'Init time': start,
+                         'Exit time': start + pd.Timedelta(minutes=10),
+                         'Exit status': 'SUCCEEDED', 'Queued time (s)': 0.0,
+                         'Elapsed time (s)': 600.0, 'Data size (GB)': 10.0 + day})
+    return job_schema.apply_schema(pd.DataFrame(rows).set_index('Batch id'))
+
+
+def suite_digests(data, tmp_path):
+    """Digests of per-suite plots, by plot file."""
+    job_data = PPTransferData(None, None, data=data)
+    job_data.derive()
+    tables, _ = roll_up(job_data, empty_tables())
+    job_data.rollups = DailyRollups(tables)
+    specs = job_data.suite_plot_specs(str(tmp_path))
+    return {spec.kwargs['plot_file']: spec_digest(spec, job_data) for spec in specs}
+
+
+def test_suite_digests(tmp_path):
+    before = suite_digests(job_frame(5), tmp_path)
+    assert suite_digests(job_frame(5), tmp_path) == before
+
+    after = suite_digests(job_frame(5, extra_suite='u-aa002'), tmp_path)
+    assert after.keys() == before.keys()
+    changed = sorted(plot for plot in before if before[plot] != after[plot])
+    assert changed == sorted(plot for plot in before if '/u-aa002_' in plot)
+    assert len(changed) == len(PPTransferData.SUITE_PLOTS)
@@ -0,0 +1,132 @@
+"""Rolling up just some suites must match rolling up all jobs."""
+
+import os
+import shutil
+import pandas as pd
+import pytest
+import job_schema
+from scripts import load_script
+from cylc_job_logs import extract_job_data, process_job_data
+from cylc_performance import CoupledData, PPTransferData, SuiteStatus
+from make_log_tree import make_tree
+from rollup_jobs import generate_rollups
+from rollups import empty_tables, read_tables, roll_up, update_rollups
+
+concat_logs = load_script('concat_logs')
+
+TASKS = ['coupled', 'pptransfer']
+
+
+def job_data(jobs):
+    """Derived pptransfer job data with jobs per suite, {suite: n}."""
+    rows = []
+    for suite, n in sorted(jobs.items()):
+        for day in range(n):
+            start = pd.Timestamp('2023-01-01', tz='UTC') + pd.Timedelta(hours=10*day)
+            rows.append({'Batch id': 1000*int(suite[-3:]) + day, 'Suite id': suite, 'Rep': 1,
+                         'Cycle': start, 'Submit time': start, 'Init time': start,
+                         'Exit time': start + pd.Timedelta(minutes=10),
+                         'Exit status': 'SUCCEEDED' if day % 4 else 'EXIT',
+                         'Queued time (s)': 0.0, 'Elapsed time (s)': 600.0 + day,
+                         'Data size (GB)': 10.0 + day})
+    columns = ['Batch id', 'Suite id'] + job_schema.JOB_COLS
+    data = pd.DataFrame(rows, columns=columns + ['Queued time (s)', 'Elapsed time (s)',
+                                                 'Data size (GB)'])
+    job_data = PPTransferData(None, None, data=job_schema.apply_schema(data.set_index('Batch id')))
+    job_data.derive()
+    return job_data
+
+
+def assert_same(tables, expected):
+    for name in expected:
+        pd.testing.assert_frame_equal(tables[name], expected[name])
+
+
+def test_roll_up_suites():
+    tables, _ = roll_up(job_data({'u-aa001': 6, 'u-aa002': 6, 'u-aa003': 6}), empty_tables())
+
+    # One suite grows
+    tables, count = roll_up(job_data({'u-aa002': 9}), tables, ['u-aa002'])
+    assert count > 0
+    expected, _ = roll_up(job_data({'u-aa001': 6, 'u-aa002': 9, 'u-aa003': 6}), empty_tables())
+    assert_same(tables, expected)
+
+    # One suite removed
+    tables, count = roll_up(job_data({}), tables, ['u-aa001'])
+    assert count == 3
+    expected, _ = roll_up(job_data({'u-aa002': 9, 'u-aa003': 6}), empty_tables())
+    assert_same(tables, expected)
+
+
+class DataDir:
+    """DATA_DIR with processed files made from a synthetic log tree, and
+    the concatenated job data."""
+
+    def __init__(self, root):
+        self.root = str(root)
+        make_tree(self.root, n_suites=3, n_cycles=8, seed=2)
+        self.suite_status = os.path.join(self.root, 'suite_status.csv')
+        for suite in ['u-bm000', 'u-bm001', 'u-bm002']:
+            os.makedirs(os.path.join(self.root, 'raw', suite))
+            os.makedirs(os.path.join(self.root, 'processed', suite))
+            for task in TASKS:
+                raw_file = self.path('raw', suite, task)
+                extract_job_data(os.path.join(self.root, 'logs', suite), task, raw_file)
+                process_job_data(raw_file, self.path('processed', suite, task))
+
+    def path(self, kind, suite, task):
+        return os.path.join(self.root, kind, suite, '{}_cylc.csv'.format(task))
+
+    def concat(self, monkeypatch, incremental):
+        monkeypatch.setenv('TASKS', ' '.join(TASKS))
+        monkeypatch.setenv('SUITE_STATUS', self.suite_status)
+        monkeypatch.setenv('DATA_DIR', self.root)
+        monkeypatch.setenv('INCREMENTAL', str(incremental))
+        concat_logs.main()
+
+    def drop_last_job(self, suite, task):
+        """Rewrite a suite's processed file without its last job."""
+        with open(self.path('processed', suite, task)) as f:
+            lines = f.readlines()
+        with open(self.path('processed', suite, task), 'w') as f:
+            f.writelines(lines[:-1])
+
+    def assert_rollups_match_full(self):
+        """Rollups match those from all the job data."""
+        rollup_dir, full_dir = os.path.join(self.root, 'rollups'), os.path.join(self.root, 'full')
+        generate_rollups(self.root, rollup_dir)
+        shutil.rmtree(full_dir, ignore_errors=True)
+        for cls, csv_file in [(CoupledData, 'coupled_jobs.csv'),
+                              (PPTransferData, 'pptransfer_jobs.csv')]:
+            job_data = cls.load_derived(os.path.join(self.root, csv_file),
+                                        SuiteStatus(self.suite_status))
+            update_rollups(job_data, full_dir)
+        tables, expected = read_tables(rollup_dir), read_tables(full_dir)
+        for name in ['status', 'metrics']:
+            cols = list(expected[name].columns)
+            pd.testing.assert_frame_equal(
+                tables[name].sort_values(cols).reset_index(drop=True),
+                expected[name].sort_values(cols).reset_index(drop=True))
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    data_dir = DataDir(tmp_path)
+    data_dir.concat(monkeypatch, incremental=True)
+    data_dir.assert_rollups_match_full()
+    return data_dir
+
+
+def test_full_concat_after_incremental(data_dir, monkeypatch):
+    # Incremental state left from before concat_logs went back to full rebuilds
+    data_dir.drop_last_job('u-bm001', 'coupled')
+    data_dir.concat(monkeypatch, incremental=False)
+    data_dir.assert_rollups_match_full()
+
+
+def test_suite_status_changed(data_dir):
+    # Cycle length changes the SYPD of jobs whose files haven't changed
+    status = pd.read_csv(data_dir.suite_status)
+    status.loc[status['Suite id'] == 'u-bm002', 'Cycle length (days)'] = 30
+    status.to_csv(data_dir.suite_status, index=False)
+    data_dir.assert_rollups_match_full()